@@ -0,0 +1,17 @@
+from db.models import db, Category
+
+# categories the benchmark questions are spread over
+BENCHMARK_CATEGORIES = 6
+
+
+def create_categories(count=BENCHMARK_CATEGORIES):
+    # questions reference their category by foreign key, which SQLite
+    # enforces as well, so categories 1..count have to exist
+    existing = {category_id for category_id, in
+                db.session.query(Category.id)}
+    for category_id in range(1, count + 1):
+        if category_id not in existing:
+            category = Category('Benchmark {}'.format(category_id))
+            category.id = category_id
+            db.session.add(category)
+    db.session.commit()
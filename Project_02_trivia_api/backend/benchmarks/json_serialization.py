@@ -0,0 +1,99 @@
+'''
+json_serialization.py
+    compares building a 1,000 question JSON response from ORM objects with
+    Flask's jsonify against the row-to-dict path with the standard library
+    and with the fast encoder
+
+Usage (from the backend directory):
+    python -m benchmarks.json_serialization
+    python -m benchmarks.json_serialization --questions 5000 --repeat 50
+'''
+
+import argparse
+import random
+import statistics
+import time
+
+from flask import jsonify as flask_jsonify
+
+from benchmarks import create_categories
+from db.models import db, create_schema, Question, format_question_rows
+from flaskr import create_app
+from flaskr.serialization import orjson, jsonify
+
+
+def fill_question_bank(size):
+    db.session.query(Question).delete()
+    create_categories()
+    db.session.bulk_insert_mappings(Question, [{
+        'question': 'Benchmark question {} with some text?'.format(number),
+        'answer': 'Answer {}'.format(number),
+        'category': random.randint(1, 6),
+        'difficulty': random.randint(1, 5),
+    } for number in range(size)])
+    db.session.commit()
+
+
+def orm_objects_flask_jsonify(selection):
+    questions = [question.format() for question in selection.all()]
+    return flask_jsonify({"success": True, "questions": questions})
+
+
+def rows_flask_jsonify(selection):
+    questions = format_question_rows(selection)
+    return flask_jsonify({"success": True, "questions": questions})
+
+
+def rows_fast_jsonify(selection):
+    questions = format_question_rows(selection)
+    return jsonify({"success": True, "questions": questions})
+
+
+def measure(build, selection, repeat):
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = build(selection)
+        size = len(response.get_data())
+        timings.append((time.perf_counter() - start) * 1000.0)
+        db.session.expunge_all()
+    return statistics.median(timings), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--database-url', default='sqlite://')
+    parser.add_argument('--questions', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=30)
+    options = parser.parse_args()
+
+    app = create_app({'DATABASE_PATH': options.database_url,
+                      'JSON_BACKEND': 'auto'})
+
+    candidates = [
+        ('orm objects + flask jsonify', orm_objects_flask_jsonify),
+        ('rows + flask jsonify', rows_flask_jsonify),
+    ]
+    if orjson is not None:
+        candidates.append(('rows + orjson', rows_fast_jsonify))
+    else:
+        print('orjson is not installed, skipping the fast encoder')
+
+    with app.test_request_context():
+        create_schema()
+        fill_question_bank(options.questions)
+        selection = Question.query.order_by(Question.id)
+
+        print('{:<30} {:>10} {:>10}'.format('path', 'ms', 'bytes'))
+        for name, build in candidates:
+            build(selection)
+            median, size = measure(build, selection, options.repeat)
+            print('{:<30} {:>10.3f} {:>10}'.format(name, median, size))
+
+        db.session.query(Question).delete()
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+'''
+msgpack_serialization.py
+    compares the encoded size, encode time and decode time of typical
+    GET /questions pages sent as JSON (Flask's jsonify and orjson) and as
+    MessagePack
+
+Usage (from the backend directory):
+    python -m benchmarks.msgpack_serialization
+    python -m benchmarks.msgpack_serialization --page-sizes 10 50 --repeat 5000
+'''
+
+import argparse
+import gzip
+import json
+import random
+import statistics
+import time
+
+from benchmarks import create_categories
+from db.models import (db, create_schema, Question, category_cache,
+                       format_question_rows)
+from flaskr import create_app
+from flaskr.serialization import msgpack, orjson, jsonify
+
+
+def fill_question_bank(size):
+    db.session.query(Question).delete()
+    create_categories()
+    db.session.bulk_insert_mappings(Question, [{
+        'question': 'Benchmark question {} with some text?'.format(number),
+        'answer': 'Answer {}'.format(number),
+        'category': random.randint(1, 6),
+        'difficulty': random.randint(1, 5),
+    } for number in range(size)])
+    db.session.commit()
+
+
+def questions_page(page_size):
+    # the response dictionary of GET /questions
+    selection = Question.query.order_by(Question.id).limit(page_size)
+    return {
+        "success": True,
+        "questions": format_question_rows(selection),
+        "total_questions": Question.query.count(),
+        "categories": category_cache.get(),
+        "current_category": None,
+        "page": 1,
+    }
+
+
+def measure(app, accept, payload, decode, repeat):
+    timings = []
+    with app.test_request_context(headers={'Accept': accept}):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = jsonify(payload)
+            timings.append((time.perf_counter() - start) * 1e6)
+        body = response.get_data()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(body)
+    decode_time = (time.perf_counter() - start) * 1e6 / repeat
+    return (statistics.median(timings), decode_time, len(body),
+            len(gzip.compress(body)), response.mimetype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--database-url', default='sqlite://')
+    parser.add_argument('--page-sizes', type=int, nargs='+',
+                        default=[10, 100])
+    parser.add_argument('--repeat', type=int, default=2000)
+    options = parser.parse_args()
+
+    if msgpack is None:
+        parser.exit(1, 'msgpack is not installed (pip install msgpack)\n')
+
+    apps = [('flask jsonify', create_app({
+        'DATABASE_PATH': options.database_url, 'JSON_BACKEND': 'json'}))]
+    if orjson is not None:
+        apps.append(('orjson', create_app({
+            'DATABASE_PATH': options.database_url,
+            'JSON_BACKEND': 'orjson'})))
+    else:
+        print('orjson is not installed, skipping the fast encoder')
+
+    with apps[0][1].app_context():
+        create_schema()
+        fill_question_bank(max(options.page_sizes))
+        pages = {size: questions_page(size) for size in options.page_sizes}
+
+    candidates = [(name, app, 'application/json', json.loads)
+                  for name, app in apps]
+    # category ids are integer map keys in MessagePack
+    candidates.append(('msgpack', apps[0][1], 'application/msgpack',
+                       lambda body: msgpack.unpackb(body,
+                                                    strict_map_key=False)))
+
+    print('{:<6} {:<14} {:>10} {:>10} {:>8} {:>8}'.format(
+        'page', 'encoding', 'encode us', 'decode us', 'bytes', 'gzip'))
+    for size, payload in pages.items():
+        for name, app, accept, decode in candidates:
+            encode_time, decode_time, length, compressed, mimetype = \
+                measure(app, accept, payload, decode, options.repeat)
+            assert mimetype == accept, mimetype
+            print('{:<6} {:<14} {:>10.1f} {:>10.1f} {:>8} {:>8}'.format(
+                size, name, encode_time, decode_time, length, compressed))
+
+    with apps[0][1].app_context():
+        db.session.query(Question).delete()
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
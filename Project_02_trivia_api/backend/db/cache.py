@@ -0,0 +1,116 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+'''
+TTLCache
+    in-process cache for a single value built by a loader function
+
+The value is loaded on first use and kept until it is explicitly
+invalidated (by the model methods writing the underlying rows) or until
+the TTL expires, which covers writes made outside of the application.
+Along with the value an ETag is computed so responses built from it can
+be revalidated by clients.
+'''
+
+
+class TTLCache:
+
+    def __init__(self, loader, ttl):
+        self.loader = loader
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entry = None
+        # bumped on every invalidation so that a value loaded concurrently
+        # with a write is never stored after the invalidation
+        self.generation = 0
+
+    def get(self):
+        return self.get_with_etag()[0]
+
+    def get_with_etag(self):
+        entry = self.entry
+        if entry is None or entry[2] < time.monotonic():
+            with self.lock:
+                # another thread may have reloaded while we were waiting
+                entry = self.entry
+                if entry is None or entry[2] < time.monotonic():
+                    generation = self.generation
+                    value = self.loader()
+                    entry = (value, make_etag(value),
+                             time.monotonic() + self.ttl)
+                    if generation == self.generation:
+                        self.entry = entry
+        return entry[0], entry[1]
+
+    def invalidate(self):
+        self.generation += 1
+        self.entry = None
+
+
+def make_etag(value):
+    payload = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+'''
+GenerationCache
+    in-process cache of values partitioned by a group (such as a category),
+    where every group has a generation counter
+
+Writes touching a group bump its generation, which makes every entry
+cached for the group stale at once without having to find and delete
+them. Entries also expire after the TTL to cover writes made by other
+processes, and the least recently used entries are evicted above limit.
+'''
+
+
+class GenerationCache:
+
+    def __init__(self, limit, ttl):
+        self.limit = limit
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.generations = {}
+        self.entries = OrderedDict()
+
+    def generation(self, group):
+        return self.generations.get(group, 0)
+
+    def get(self, group, key):
+        with self.lock:
+            entry = self.entries.get((group, key))
+            if entry is None:
+                return None
+            generation, expires, value = entry
+            if (generation != self.generations.get(group, 0) or
+                    expires < time.monotonic()):
+                del self.entries[(group, key)]
+                return None
+            self.entries.move_to_end((group, key))
+            return value
+
+    def set(self, group, key, value, generation):
+        # generation must be read before building the value, so a value
+        # built while a write bumped the group is never served
+        with self.lock:
+            if generation != self.generations.get(group, 0):
+                return
+            self.entries[(group, key)] = (
+                generation, time.monotonic() + self.ttl, value)
+            self.entries.move_to_end((group, key))
+            while len(self.entries) > self.limit:
+                self.entries.popitem(last=False)
+
+    def bump(self, group):
+        with self.lock:
+            self.generations[group] = self.generations.get(group, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            for group in set(self.generations) | {
+                    group for group, _ in self.entries}:
+                self.generations[group] = self.generations.get(group, 0) + 1
+            self.entries.clear()
@@ -0,0 +1,110 @@
+import hashlib
+import math
+
+from db.text import normalize_text
+
+'''
+Duplicate questions
+
+Every question stores the hash of its normalized text (see db/text.py):
+accents, case, punctuation and extra spaces removed, so "What is the
+largest lake in Africa?" and "what is the largest lake in africa" share a
+hash. An index on the hash lets an insert find an exact duplicate with
+one lookup.
+
+find_duplicates() also finds near-duplicates, questions worded slightly
+differently with the same answer, without comparing every pair. The
+words of a question are sorted rarest first; two questions whose word
+sets have a Jaccard similarity of at least the threshold share a word
+among the first len - ceil(threshold * len) + 1 of them (prefix
+filtering), so only questions sharing one of those rare words are
+compared.
+'''
+
+# Jaccard similarity above which two questions are near-duplicates
+DEDUPE_THRESHOLD = 0.8
+
+
+def question_hash(text):
+    '''
+    question_hash(text)
+        returns the hex SHA-1 of the normalized question text, or None for
+        an empty question
+    '''
+    normalized = normalize_text(text)
+    if not normalized:
+        return None
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second)
+
+
+def find_duplicates(rows, threshold=DEDUPE_THRESHOLD):
+    '''
+    find_duplicates(rows, threshold)
+        returns the groups of duplicate questions among (id, question,
+        answer) rows as sorted lists of ids, the lowest id first; questions
+        with the same hash are duplicates, others when their answers match
+        and their words are similar enough
+    '''
+    words = {}
+    answers = {}
+    hashes = {}
+    frequency = {}
+    for question_id, question, answer in rows:
+        normalized = normalize_text(question)
+        if not normalized:
+            continue
+        words[question_id] = set(normalized.split())
+        answers[question_id] = normalize_text(answer)
+        hashes.setdefault(question_hash(question), []).append(question_id)
+        for word in words[question_id]:
+            frequency[word] = frequency.get(word, 0) + 1
+
+    # union find over the ids, the root of a group is its lowest id
+    parent = {question_id: question_id for question_id in words}
+
+    def find(question_id):
+        while parent[question_id] != question_id:
+            parent[question_id] = parent[parent[question_id]]
+            question_id = parent[question_id]
+        return question_id
+
+    def union(first, second):
+        first, second = find(first), find(second)
+        if first != second:
+            parent[max(first, second)] = min(first, second)
+
+    for question_ids in hashes.values():
+        for question_id in question_ids[1:]:
+            union(question_ids[0], question_id)
+
+    # block the questions by the rare words of their prefix and compare
+    # only the questions of a block
+    blocks = {}
+    for question_id, question_words in words.items():
+        ordered = sorted(question_words,
+                         key=lambda word: (frequency[word], word))
+        prefix = len(ordered) - math.ceil(threshold * len(ordered)) + 1
+        for word in ordered[:prefix]:
+            blocks.setdefault(word, []).append(question_id)
+
+    compared = set()
+    for question_ids in blocks.values():
+        for index, first in enumerate(question_ids):
+            for second in question_ids[index + 1:]:
+                pair = (first, second)
+                if pair in compared:
+                    continue
+                compared.add(pair)
+                if (answers[first] == answers[second] and
+                        jaccard(words[first], words[second]) >= threshold):
+                    union(first, second)
+
+    groups = {}
+    for question_id in words:
+        groups.setdefault(find(question_id), []).append(question_id)
+    return sorted(sorted(group) for group in groups.values()
+                  if len(group) > 1)
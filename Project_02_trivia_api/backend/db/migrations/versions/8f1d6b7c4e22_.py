@@ -0,0 +1,61 @@
+"""convert questions.category to an indexed foreign key
+
+Revision ID: 8f1d6b7c4e22
+Revises: 3c5e2a91d0b4
+Create Date: 2026-10-19 10:24:05.917342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f1d6b7c4e22'
+down_revision = '3c5e2a91d0b4'
+branch_labels = None
+depends_on = None
+
+
+def category_foreign_keys():
+    # names of the foreign keys on questions.category, databases restored
+    # from trivia.psql have one named "category"; SQLite may report None
+    foreign_keys = sa.inspect(op.get_bind()).get_foreign_keys('questions')
+    return [foreign_key['name'] for foreign_key in foreign_keys
+            if foreign_key['constrained_columns'] == ['category']]
+
+
+def upgrade():
+    # the foreign key is created in the form of the one of trivia.psql,
+    # also after a downgrade dropped that one
+    create_foreign_key = not category_foreign_keys()
+
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.alter_column('category',
+                              existing_type=sa.String(),
+                              type_=sa.Integer(),
+                              postgresql_using='category::integer')
+        if create_foreign_key:
+            batch_op.create_foreign_key('fk_questions_category_categories',
+                                        'categories', ['category'], ['id'],
+                                        onupdate='CASCADE',
+                                        ondelete='SET NULL')
+        batch_op.create_index('ix_questions_category_id',
+                              ['category', 'id'])
+        batch_op.create_index('ix_questions_category_difficulty',
+                              ['category', 'difficulty'])
+
+
+def downgrade():
+    # a string column cannot reference categories.id, drop the foreign key
+    # whether this migration or trivia.psql created it
+    names = category_foreign_keys()
+
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_index('ix_questions_category_difficulty')
+        batch_op.drop_index('ix_questions_category_id')
+        for name in names:
+            if name is not None:
+                batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.alter_column('category',
+                              existing_type=sa.Integer(),
+                              type_=sa.String())
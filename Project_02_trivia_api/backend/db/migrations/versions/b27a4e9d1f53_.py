@@ -0,0 +1,32 @@
+"""add trigram index for question search
+
+Revision ID: b27a4e9d1f53
+Revises: 8f1d6b7c4e22
+Create Date: 2026-10-19 10:31:48.205716
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b27a4e9d1f53'
+down_revision = '8f1d6b7c4e22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the trigram operator class only exists on Postgres, other databases
+    # cannot serve the search from an index and get none
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_questions_question_trgm', 'questions', ['question'],
+                    unique=False, postgresql_using='gin',
+                    postgresql_ops={'question': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_questions_question_trgm', table_name='questions')
@@ -0,0 +1,63 @@
+"""add normalized question hash
+
+Revision ID: e5b9f27c3a81
+Revises: d4c81f0e7a36
+Create Date: 2026-10-19 16:22:40.517093
+
+"""
+import hashlib
+import re
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b9f27c3a81'
+down_revision = 'd4c81f0e7a36'
+branch_labels = None
+depends_on = None
+
+# frozen copy of the question hash of this revision, the migration must
+# backfill the same hashes whatever later changes db/text.py and
+# db/dedupe.py
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+def question_hash(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    normalized = ' '.join(PUNCTUATION.sub(' ', text.casefold()).split())
+    if not normalized:
+        return None
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.add_column(sa.Column('question_hash', sa.String(length=40),
+                                      nullable=True))
+        batch_op.create_index('ix_questions_question_hash',
+                              ['question_hash'], unique=False)
+
+    # hash the existing questions
+    questions = sa.table('questions', sa.column('id', sa.Integer),
+                         sa.column('question', sa.String),
+                         sa.column('question_hash', sa.String))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select([questions.c.id, questions.c.question]))
+    hashes = [{'question_id': row.id, 'hash': question_hash(row.question)}
+              for row in rows]
+    if hashes:
+        bind.execute(
+            questions.update().where(
+                questions.c.id == sa.bindparam('question_id')).values(
+                question_hash=sa.bindparam('hash')),
+            hashes)
+
+
+def downgrade():
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_index('ix_questions_question_hash')
+        batch_op.drop_column('question_hash')
@@ -1,7 +1,14 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import (DDL, Column, String, Integer, Boolean, DateTime,
+                        ForeignKey, Index, bindparam, event, func)
 from flask_sqlalchemy import SQLAlchemy
-import json
+from flask_migrate import Migrate
+
+from db.cache import TTLCache, GenerationCache
+from db.dedupe import question_hash
+from db.question_pool import QuestionPool, pool_key
+from db.search_index import SearchIndex
+from db.sqlite import is_sqlite, sqlite_engine_options
 
 database_name = "trivia"
 # database_path = "postgresql://{}/{}".format('localhost:5432', database_name)
@@ -9,18 +16,86 @@ database_path = "postgresql://{}:{}@{}/{}".format(
     'postgres', 'postgres', 'localhost:5432', database_name)
 
 db = SQLAlchemy()
+migrate = Migrate()
+
+# alembic migration scripts, run them with "flask db upgrade"
+migrations_directory = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# seconds after which cached category data is reloaded even without writes
+CATEGORY_CACHE_TTL = 300
+# seconds after which the question counts per category are recounted
+CATEGORY_STATS_TTL = 300
+# seconds after which the quiz question pool is reloaded from the database
+QUESTION_POOL_TTL = 300
+# seconds after which the in-memory search index is reloaded
+SEARCH_INDEX_TTL = 300
+# number of category question pages kept in memory and seconds they are kept
+CATEGORY_QUESTIONS_CACHE_LIMIT = 1000
+CATEGORY_QUESTIONS_CACHE_TTL = 60
+# number of normalized answers kept in memory and seconds they are kept
+ANSWER_CACHE_LIMIT = 10000
+ANSWER_CACHE_TTL = 3600
+# rows per statement of the bulk question writes, below the SQLite limit of
+# 999 bound parameters for IN lists
+BULK_CHUNK_SIZE = 500
+
+'''
+category_questions_cache
+    responses of GET /categories/<id>/questions by category and page,
+    made stale by bumping the category generation whenever a question of
+    the category is inserted or deleted
+'''
+category_questions_cache = GenerationCache(CATEGORY_QUESTIONS_CACHE_LIMIT,
+                                           CATEGORY_QUESTIONS_CACHE_TTL)
+
+'''
+answer_cache
+    answers of the questions with their normalized forms, by question id,
+    made stale by bumping the question id when the question is updated or
+    deleted
+'''
+answer_cache = GenerationCache(ANSWER_CACHE_LIMIT, ANSWER_CACHE_TTL)
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the schema is managed by the migrations in db/migrations
+    database_path may also be a SQLite URI, see db/sqlite.py
 '''
 
 
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if is_sqlite(database_path):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlite_engine_options(
+            database_path)
     db.app = app
     db.init_app(app)
+    migrate.init_app(app, db, directory=migrations_directory,
+                     include_object=include_schema_object)
+    category_cache.invalidate()
+    category_stats_cache.invalidate()
+    question_pool.invalidate()
+    search_index.invalidate()
+    category_questions_cache.clear()
+    answer_cache.clear()
+
+
+'''
+create_schema()
+    creates the tables from the models without the migrations, for
+    throwaway databases such as the ones of the tests and benchmarks
+    on Postgres the pg_trgm extension of the trigram index is created
+    first, the index itself by an after_create listener
+'''
+
+
+def create_schema():
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        db.session.commit()
     db.create_all()
 
 
@@ -32,29 +107,181 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # back the category listing (ordered by id) and the quiz queries
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+        # find duplicates of a new question, not unique so that existing
+        # duplicates can be loaded and removed with "flask questions dedupe"
+        Index('ix_questions_question_hash', 'question_hash'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey(
+        'categories.id', name='fk_questions_category_categories',
+        onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
+    # hash of the normalized question text, see db/dedupe.py
+    question_hash = Column(String(40))
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
         self.answer = answer
         self.category = category
         self.difficulty = difficulty
+        self.question_hash = question_hash(question)
 
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        question_pool.add(self.id, self.category, self.difficulty)
+        search_index.add(self.id, self.question, self.answer)
+        category_questions_cache.bump(pool_key(self.category))
+        category_stats_cache.invalidate()
 
     def update(self):
+        self.question_hash = question_hash(self.question)
         db.session.commit()
+        # the category may have changed, rebuild the pool on next use
+        question_pool.invalidate()
+        search_index.add(self.id, self.question, self.answer)
+        category_questions_cache.clear()
+        category_stats_cache.invalidate()
+        answer_cache.bump(self.id)
 
     def delete(self):
+        question_id = self.id
+        category = pool_key(self.category)
         db.session.delete(self)
         db.session.commit()
+        question_pool.remove(question_id)
+        search_index.remove(question_id)
+        category_questions_cache.bump(category)
+        category_stats_cache.invalidate()
+        answer_cache.bump(question_id)
+
+    @classmethod
+    def insert_many(cls, rows):
+        '''
+        insert_many(rows)
+            inserts the questions given as dictionaries of question, answer,
+            category and difficulty in one transaction, returns their ids
+        '''
+        if not rows:
+            return []
+
+        rows = [dict(row, question_hash=question_hash(row['question']))
+                for row in rows]
+        table = cls.__table__
+        dialect = db.engine.dialect
+        ids = []
+        if dialect.implicit_returning and dialect.supports_multivalues_insert:
+            # one multi-row INSERT ... RETURNING per chunk (Postgres)
+            for start in range(0, len(rows), BULK_CHUNK_SIZE):
+                chunk = rows[start:start + BULK_CHUNK_SIZE]
+                result = db.session.execute(
+                    table.insert().values(chunk).returning(table.c.id))
+                ids.extend(row[0] for row in result)
+        elif dialect.name == 'sqlite':
+            # executemany cannot return the ids on SQLite. The first insert
+            # takes the database-wide write lock, so the rest get the next
+            # rowids in order
+            result = db.session.execute(table.insert(), rows[0])
+            first_id = result.inserted_primary_key[0]
+            if len(rows) > 1:
+                db.session.execute(table.insert(), rows[1:])
+            ids = list(range(first_id, first_id + len(rows)))
+        else:
+            # other databases may interleave the ids of concurrent inserts,
+            # read the id of every row
+            for row in rows:
+                result = db.session.execute(table.insert(), row)
+                ids.append(result.inserted_primary_key[0])
+        db.session.commit()
+
+        categories = set()
+        for question_id, row in zip(ids, rows):
+            question_pool.add(question_id, row['category'], row['difficulty'])
+            search_index.add(question_id, row['question'], row['answer'])
+            categories.add(pool_key(row['category']))
+        for category in categories:
+            category_questions_cache.bump(category)
+        category_stats_cache.invalidate()
+        return ids
+
+    @classmethod
+    def delete_many(cls, question_ids):
+        '''
+        delete_many(question_ids)
+            deletes the questions with the given ids in one transaction,
+            returns the ids of the questions that existed
+        '''
+        question_ids = list(set(question_ids))
+        deleted = []
+        categories = set()
+        for start in range(0, len(question_ids), BULK_CHUNK_SIZE):
+            chunk = question_ids[start:start + BULK_CHUNK_SIZE]
+            rows = db.session.query(cls.id, cls.category).filter(
+                cls.id.in_(chunk)).all()
+            if rows:
+                db.session.query(cls).filter(
+                    cls.id.in_([row.id for row in rows])).delete(
+                    synchronize_session=False)
+            deleted.extend(row.id for row in rows)
+            categories.update(pool_key(row.category) for row in rows)
+        db.session.commit()
+
+        for question_id in deleted:
+            question_pool.remove(question_id)
+            search_index.remove(question_id)
+            answer_cache.bump(question_id)
+        for category in categories:
+            category_questions_cache.bump(category)
+        category_stats_cache.invalidate()
+        return sorted(deleted)
+
+    @classmethod
+    def find_duplicates(cls, hashes):
+        '''
+        find_duplicates(hashes)
+            returns a dictionary of question hash to the lowest id of the
+            questions with that hash, for the hashes that exist
+        '''
+        hashes = list(set(hashes) - {None})
+        duplicates = {}
+        for start in range(0, len(hashes), BULK_CHUNK_SIZE):
+            chunk = hashes[start:start + BULK_CHUNK_SIZE]
+            duplicates.update(db.session.query(
+                cls.question_hash, func.min(cls.id)).filter(
+                cls.question_hash.in_(chunk)).group_by(cls.question_hash))
+        return duplicates
+
+    @classmethod
+    def backfill_hashes(cls):
+        '''
+        backfill_hashes()
+            sets the hash of the questions without one, e.g. loaded from
+            trivia.psql, returns the number of questions updated
+        '''
+        rows = db.session.query(cls.id, cls.question).filter(
+            cls.question_hash.is_(None)).all()
+        if rows:
+            db.session.execute(
+                cls.__table__.update().where(
+                    cls.id == bindparam('question_id')).values(
+                    question_hash=bindparam('hash')),
+                [{'question_id': row.id, 'hash': question_hash(row.question)}
+                 for row in rows])
+        db.session.commit()
+        return len(rows)
+
+    @classmethod
+    def search(cls, search_term):
+        # substring match served by the trigram index on Postgres
+        return cls.query.filter(
+            cls.question.ilike('%{}%'.format(search_term)))
 
     def format(self):
         return {
@@ -66,6 +293,44 @@ class Question(db.Model):
         }
 
 
+'''
+format_question_rows(selection)
+    runs a Question query selecting only the columns returned by
+    Question.format() and returns the rows as dictionaries, without
+    building Question objects
+'''
+
+question_columns = (Question.id, Question.question, Question.answer,
+                    Question.category, Question.difficulty)
+
+
+def format_question_rows(selection):
+    return [row._asdict()
+            for row in selection.with_entities(*question_columns)]
+
+
+'''
+Trigram index
+    lets Postgres answer the ILIKE '%term%' search with a GIN index lookup
+    instead of a full scan, it needs the pg_trgm extension (see
+    create_schema). Other databases cannot use an index for the search, so
+    the index is only created on Postgres rather than declared on the
+    model, where it would become a plain index slowing every write.
+'''
+
+POSTGRES_ONLY_INDEXES = ('ix_questions_question_trgm',)
+
+event.listen(Question.__table__, 'after_create', DDL(
+    'CREATE INDEX ix_questions_question_trgm ON questions '
+    'USING gin (question gin_trgm_ops)').execute_if(dialect='postgresql'))
+
+
+def include_schema_object(schema_object, name, type_, reflected, compare_to):
+    # keeps "flask db migrate" from dropping the indexes created outside
+    # the model
+    return not (type_ == 'index' and name in POSTGRES_ONLY_INDEXES)
+
+
 '''
 Category
 
@@ -81,8 +346,187 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        category_cache.invalidate()
+        category_stats_cache.invalidate()
+        category_questions_cache.clear()
+
+    def update(self):
+        db.session.commit()
+        category_cache.invalidate()
+        category_stats_cache.invalidate()
+        category_questions_cache.clear()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        category_cache.invalidate()
+        category_stats_cache.invalidate()
+        category_questions_cache.clear()
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
         }
+
+
+'''
+QuizAttempt
+    one answer of a quiz, written in bulk by the result buffer
+
+question_id has no foreign key so that deleting a question never makes
+a buffered batch of attempts fail.
+'''
+
+
+class QuizAttempt(db.Model):
+    __tablename__ = 'quiz_attempts'
+    __table_args__ = (
+        Index('ix_quiz_attempts_question_id', 'question_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String)
+    question_id = Column(Integer, nullable=False)
+    category = Column(Integer)
+    correct = Column(Boolean, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
+'''
+QuizScore
+    final score of a quiz, written in bulk by the result buffer
+    category is None for quizzes over all categories
+'''
+
+
+class QuizScore(db.Model):
+    __tablename__ = 'quiz_scores'
+    __table_args__ = (
+        # back the leaderboards, overall and per category
+        Index('ix_quiz_scores_score', 'score'),
+        Index('ix_quiz_scores_category_score', 'category', 'score'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String, nullable=False)
+    category = Column(Integer)
+    score = Column(Integer, nullable=False)
+    total = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+    @classmethod
+    def leaderboard(cls, category=None, limit=10):
+        # best scores first, the earliest one wins a tie
+        selection = cls.query
+        if category is not None:
+            selection = selection.filter(cls.category == category)
+        return selection.order_by(cls.score.desc(), cls.created_at,
+                                  cls.id).limit(limit)
+
+    def format(self):
+        return {
+            'id': self.id,
+            'player': self.player,
+            'category': self.category,
+            'score': self.score,
+            'total': self.total,
+            'created_at': self.created_at.isoformat(),
+        }
+
+
+'''
+load_categories()
+    returns a dictionary of category id to category type
+'''
+
+
+def load_categories():
+    categories = Category.query.order_by(Category.id).all()
+    return {category.id: category.type for category in categories}
+
+
+'''
+category_cache
+    in-process cache of the category dictionary, invalidated by the
+    Category write methods and reloaded after CATEGORY_CACHE_TTL seconds
+'''
+category_cache = TTLCache(load_categories, CATEGORY_CACHE_TTL)
+
+
+'''
+load_category_stats()
+    returns the number of questions of every category and their number
+    per difficulty, counted with one GROUP BY served by the
+    (category, difficulty) index:
+    {category id: {'total': n, 'difficulties': {difficulty: n}}}
+    questions without a category are not counted, questions without a
+    difficulty only in the total
+'''
+
+
+def load_category_stats():
+    rows = db.session.query(
+        Question.category, Question.difficulty, func.count(Question.id)
+    ).filter(Question.category.isnot(None)).group_by(
+        Question.category, Question.difficulty)
+
+    stats = {}
+    for category, difficulty, count in rows:
+        entry = stats.setdefault(category, {'total': 0, 'difficulties': {}})
+        entry['total'] += count
+        if difficulty is not None:
+            entry['difficulties'][difficulty] = count
+    return stats
+
+
+'''
+category_stats_cache
+    in-process cache of the question counts per category, invalidated by
+    the Question and Category write methods and recounted after
+    CATEGORY_STATS_TTL seconds
+'''
+category_stats_cache = TTLCache(load_category_stats, CATEGORY_STATS_TTL)
+
+
+'''
+load_question_pool()
+    returns the (id, category, difficulty) rows of all questions without
+    loading full rows
+'''
+
+
+def load_question_pool():
+    return db.session.query(
+        Question.id, Question.category, Question.difficulty).all()
+
+
+'''
+question_pool
+    in-memory question ids per category used by the quiz, kept up to date
+    by the Question write methods and reloaded after QUESTION_POOL_TTL seconds
+'''
+question_pool = QuestionPool(load_question_pool, QUESTION_POOL_TTL)
+
+
+'''
+load_search_index()
+    returns the (id, question, answer) rows of all questions
+'''
+
+
+def load_search_index():
+    return db.session.query(
+        Question.id, Question.question, Question.answer).all()
+
+
+'''
+search_index
+    in-memory inverted index of the question texts, an alternative to the
+    SQL search selected with the SEARCH_BACKEND config key, kept up to date
+    by the Question write methods and reloaded after SEARCH_INDEX_TTL seconds
+'''
+search_index = SearchIndex(load_search_index, SEARCH_INDEX_TTL)
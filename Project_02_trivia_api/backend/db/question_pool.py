@@ -0,0 +1,199 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+'''
+QuestionPool
+    in-memory arrays of question ids per category used to pick quiz
+    questions without querying the questions table
+
+The pool is loaded on first use from a loader returning
+(id, category, difficulty) rows and then kept up to date by
+Question.insert() and delete(). Every category has its own id array and
+the None key holds the ids of all questions. Every (category, difficulty)
+pair, with None for all categories, has a bucket of its own so the
+adaptive quiz picks a question of a given difficulty in O(1) too.
+Removal swaps the last id into the freed slot, so adding,
+removing and sampling an id are all O(1). The pool is reloaded after
+the TTL to pick up writes made by other processes.
+
+Code running on an event loop must not block on the synchronous loader.
+It uses the pool inside without_loading(), where a pool that needs to be
+loaded raises PoolNotLoaded instead, and loads it with load_rows().
+'''
+
+# random draws attempted before falling back to scanning the category
+MAX_SAMPLE_ATTEMPTS = 16
+
+
+class PoolNotLoaded(Exception):
+    # raised by a pool that needs to be loaded inside without_loading()
+    pass
+
+
+class ExcludeAll:
+    # excludes the ids contained in any of several collections, such as the
+    # played questions and the ones picked so far for a prefetch
+
+    def __init__(self, *collections):
+        self.collections = collections
+
+    def __contains__(self, question_id):
+        return any(question_id in collection
+                   for collection in self.collections)
+
+
+def pool_key(category):
+    # categories may arrive as integers or numeric strings
+    if category is None:
+        return None
+    try:
+        return int(category)
+    except (TypeError, ValueError):
+        return category
+
+
+class QuestionPool:
+
+    def __init__(self, loader, ttl):
+        self.loader = loader
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.ids = None
+        self.positions = None
+        self.difficulties = None
+        self.expires = 0
+        # without_loading() flag of the current thread
+        self.local = threading.local()
+
+    def load(self):
+        # called with the lock held
+        self.load_rows(self.loader())
+
+    def load_rows(self, rows):
+        # (id, category, difficulty) rows, used directly by loaders that
+        # cannot run inside the pool (such as the async database of the
+        # ASGI app)
+        with self.lock:
+            self.ids = {None: []}
+            self.positions = {None: {}}
+            self.difficulties = {}
+            for question_id, category, difficulty in rows:
+                self._append(question_id, pool_key(category), difficulty)
+            self.expires = time.monotonic() + self.ttl
+
+    def needs_load(self):
+        return self.ids is None or self.expires < time.monotonic()
+
+    def ensure_loaded(self):
+        # called with the lock held
+        if self.needs_load():
+            if getattr(self.local, 'without_loading', False):
+                raise PoolNotLoaded()
+            self.load()
+
+    @contextmanager
+    def without_loading(self):
+        '''
+        without_loading()
+            context in which the current thread never runs the loader, the
+            pool raises PoolNotLoaded when it needs to be loaded
+        '''
+        self.local.without_loading = True
+        try:
+            yield
+        finally:
+            self.local.without_loading = False
+
+    def _append(self, question_id, key, difficulty):
+        pools = (key, None)
+        difficulty = pool_key(difficulty)
+        if difficulty is not None:
+            self.difficulties[question_id] = difficulty
+            pools += ((key, difficulty), (None, difficulty))
+        for pool in pools:
+            positions = self.positions.setdefault(pool, {})
+            if question_id in positions:
+                continue
+            ids = self.ids.setdefault(pool, [])
+            positions[question_id] = len(ids)
+            ids.append(question_id)
+
+    def _discard(self, question_id, pool):
+        positions = self.positions.get(pool)
+        if not positions or question_id not in positions:
+            return
+        ids = self.ids[pool]
+        index = positions.pop(question_id)
+        last = ids.pop()
+        if last != question_id:
+            ids[index] = last
+            positions[last] = index
+
+    def add(self, question_id, category, difficulty=None):
+        with self.lock:
+            # an unloaded pool picks the question up when it loads
+            if self.ids is not None:
+                self._append(question_id, pool_key(category), difficulty)
+
+    def remove(self, question_id):
+        with self.lock:
+            if self.ids is not None:
+                self.difficulties.pop(question_id, None)
+                for pool in list(self.positions):
+                    self._discard(question_id, pool)
+
+    def invalidate(self):
+        with self.lock:
+            self.ids = None
+            self.positions = None
+            self.difficulties = None
+
+    def count(self, category=None, difficulty=None):
+        with self.lock:
+            self.ensure_loaded()
+            return len(self.ids.get(self._pool(category, difficulty), ()))
+
+    def question_at(self, category, position):
+        # id at a position of the category array, None past its end; the
+        # positions change when ids are removed
+        with self.lock:
+            self.ensure_loaded()
+            ids = self.ids.get(pool_key(category), ())
+            return ids[position] if position < len(ids) else None
+
+    def difficulty(self, question_id):
+        # difficulty of a question of the pool, None if unknown
+        with self.lock:
+            self.ensure_loaded()
+            return self.difficulties.get(question_id)
+
+    def _pool(self, category, difficulty):
+        key = pool_key(category)
+        return key if difficulty is None else (key, pool_key(difficulty))
+
+    def choose(self, category=None, exclude=(), difficulty=None):
+        '''
+        choose(category, exclude, difficulty)
+            returns a random question id of the category (all questions
+            when category is None) and of the difficulty (any when None)
+            that is not in exclude, or None when every such question was
+            excluded
+        '''
+        with self.lock:
+            self.ensure_loaded()
+            ids = self.ids.get(self._pool(category, difficulty))
+            if not ids:
+                return None
+
+            # rejection sampling is O(1) as long as most ids are unused
+            for _ in range(MAX_SAMPLE_ATTEMPTS):
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in exclude:
+                    return question_id
+
+            # most of the category was already played, pick among the rest
+            remaining = [question_id for question_id in ids
+                         if question_id not in exclude]
+            return random.choice(remaining) if remaining else None
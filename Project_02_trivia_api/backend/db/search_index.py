@@ -0,0 +1,147 @@
+import re
+import threading
+import time
+
+'''
+SearchIndex
+    in-memory inverted index over the question and answer text used to
+    search questions without the Postgres trigram index
+
+The index maps every lower case word of a field to the ids of the
+questions containing it and keeps the lower case text of every question.
+A search term is turned into the same pattern as the SQL ILIKE search
+('%term%', where % and _ are wildcards); the words of its longest literal
+part select candidate questions from the index and every candidate is
+checked against the pattern, so the results are the ones of the SQL
+search. The index is loaded on first use from a loader returning
+(id, question, answer) rows, kept up to date by Question.insert(),
+update() and delete(), and reloaded after the TTL to pick up writes made
+by other processes.
+'''
+
+FIELDS = ('question', 'answer')
+
+WORD = re.compile(r'\w+')
+
+
+def like_pattern(search_term):
+    # the regular expression matching what ILIKE '%term%' matches
+    parts = []
+    for char in search_term:
+        if char == '%':
+            parts.append('.*')
+        elif char == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(char))
+    return re.compile(''.join(parts), re.IGNORECASE | re.DOTALL)
+
+
+class SearchIndex:
+
+    def __init__(self, loader, ttl):
+        self.loader = loader
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.postings = None
+        self.texts = None
+        self.expires = 0
+
+    def load(self):
+        # called with the lock held
+        self.postings = {field: {} for field in FIELDS}
+        self.texts = {}
+        for question_id, question, answer in self.loader():
+            self._index(question_id, question, answer)
+        self.expires = time.monotonic() + self.ttl
+
+    def needs_load(self):
+        return self.postings is None or self.expires < time.monotonic()
+
+    def ensure_loaded(self):
+        # called with the lock held
+        if self.needs_load():
+            self.load()
+
+    def _index(self, question_id, question, answer):
+        texts = ((question or '').lower(), (answer or '').lower())
+        self.texts[question_id] = texts
+        for field, text in zip(FIELDS, texts):
+            postings = self.postings[field]
+            for word in set(WORD.findall(text)):
+                postings.setdefault(word, set()).add(question_id)
+
+    def _unindex(self, question_id):
+        texts = self.texts.pop(question_id, None)
+        if texts is None:
+            return
+        for field, text in zip(FIELDS, texts):
+            postings = self.postings[field]
+            for word in set(WORD.findall(text)):
+                ids = postings.get(word)
+                if ids is not None:
+                    ids.discard(question_id)
+                    if not ids:
+                        del postings[word]
+
+    def add(self, question_id, question, answer):
+        with self.lock:
+            # an unloaded index picks the question up when it loads
+            if self.postings is not None:
+                self._unindex(question_id)
+                self._index(question_id, question, answer)
+
+    def remove(self, question_id):
+        with self.lock:
+            if self.postings is not None:
+                self._unindex(question_id)
+
+    def invalidate(self):
+        with self.lock:
+            self.postings = None
+            self.texts = None
+
+    def _candidates(self, field, literal):
+        # called with the lock held, None means every question
+        postings = self.postings[field]
+        candidates = None
+        for match in WORD.finditer(literal):
+            word = match.group()
+            # the words at the edges of the literal may be parts of longer
+            # words of the text, the inner ones are whole words
+            open_left = match.start() == 0
+            open_right = match.end() == len(literal)
+            if not open_left and not open_right:
+                ids = postings.get(word, set())
+            else:
+                ids = set()
+                for indexed, indexed_ids in postings.items():
+                    if ((open_left and open_right and word in indexed) or
+                            (open_left and not open_right and
+                             indexed.endswith(word)) or
+                            (open_right and not open_left and
+                             indexed.startswith(word))):
+                        ids |= indexed_ids
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, search_term, field='question'):
+        '''
+        search(search_term, field)
+            returns the sorted ids of the questions whose field contains
+            the search term, as matched by ILIKE '%search_term%'
+        '''
+        pattern = like_pattern(search_term)
+        literal = max(re.split('[%_]', search_term.lower()), key=len)
+        position = FIELDS.index(field)
+
+        with self.lock:
+            self.ensure_loaded()
+            candidates = self._candidates(field, literal)
+            if candidates is None:
+                candidates = self.texts.keys()
+            return sorted(
+                question_id for question_id in candidates
+                if pattern.search(self.texts[question_id][position]))
@@ -0,0 +1,81 @@
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+
+'''
+SQLite support
+
+Lets the app, the tests and the benchmarks run on SQLite instead of
+Postgres by passing a sqlite:// URI to setup_db().
+
+Every SQLite connection is tuned when it is opened:
+    journal_mode=WAL     readers do not block the writer and vice versa
+    synchronous=NORMAL   fsync only at checkpoints, safe with WAL
+    mmap_size            read the database file through memory mapping
+    foreign_keys=ON      enforce the foreign keys (off by default)
+    busy_timeout         wait for a lock instead of failing right away
+
+The pysqlite driver starts transactions on its own and ignores
+SAVEPOINT, which breaks the transaction per test of the test suite. Its
+transaction handling is turned off and SQLAlchemy emits BEGIN itself.
+
+A file database gets a connection pool shared by all threads (pysqlite
+forbids it by default), an in-memory database a single connection shared
+by all threads so every session sees the same data.
+'''
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('foreign_keys', 'ON'),
+    ('busy_timeout', 5000),
+)
+
+# connections kept by the pool of a file database
+SQLITE_POOL_SIZE = 5
+SQLITE_MAX_OVERFLOW = 10
+
+
+def is_sqlite(database_path):
+    return database_path.startswith('sqlite')
+
+
+def is_memory_database(database_path):
+    return make_url(database_path).database in (None, '', ':memory:')
+
+
+def sqlite_engine_options(database_path):
+    '''
+    sqlite_engine_options(database_path)
+        returns the create_engine() options of a SQLite database
+    '''
+    options = {'connect_args': {'check_same_thread': False}}
+    if is_memory_database(database_path):
+        options['poolclass'] = StaticPool
+    else:
+        options.update(poolclass=QueuePool, pool_size=SQLITE_POOL_SIZE,
+                       max_overflow=SQLITE_MAX_OVERFLOW)
+    return options
+
+
+@event.listens_for(Engine, 'connect')
+def configure_connection(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    # let SQLAlchemy emit BEGIN, see begin_transaction
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
+
+
+@event.listens_for(Engine, 'begin')
+def begin_transaction(connection):
+    if connection.dialect.name == 'sqlite':
+        connection.execute('BEGIN')
@@ -0,0 +1,30 @@
+import re
+import unicodedata
+
+'''
+Text normalization
+
+Question and answer texts are compared after normalization: accents,
+case, punctuation and extra spaces removed, so "What is the largest lake
+in Africa?" and "what is the largest lake in africa" are the same text.
+Used by the duplicate question check (db/dedupe.py) and the answer check
+(flaskr/answers.py).
+'''
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+def normalize_words(text):
+    '''
+    normalize_words(text)
+        returns the words of the text without accents, case and
+        punctuation, an empty list for an empty or missing text
+    '''
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return PUNCTUATION.sub(' ', text.casefold()).split()
+
+
+def normalize_text(text):
+    # the normalized words joined by single spaces
+    return ' '.join(normalize_words(text))
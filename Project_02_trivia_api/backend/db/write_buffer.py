@@ -0,0 +1,162 @@
+import atexit
+import logging
+import threading
+
+from flask import has_app_context
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+'''
+WriteBuffer
+    in-process buffer of rows written to the database in bulk
+
+Rows are appended per table and written with one multi-row INSERT and one
+commit per flush instead of one transaction per row. A background thread
+flushes the buffer every flush_interval seconds, or as soon as it holds
+flush_size rows. Without the thread (flush_interval None) the request
+that fills the buffer flushes it. The buffer is flushed once more when
+the process exits.
+
+When the database cannot be reached the rows are kept for the next
+flush, up to max_pending rows; older rows are dropped beyond that so a
+database outage cannot exhaust the memory. When the database rejects the
+batch for another reason the rows are written one by one and only the
+rows it rejects are dropped, so one bad row cannot hold back the others.
+'''
+
+
+class WriteBuffer:
+
+    def __init__(self, app, db, flush_size, flush_interval, max_pending):
+        self.app = app
+        self.db = db
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        # serializes flushes, rows are written in the order of append()
+        self.flush_lock = threading.Lock()
+        # table -> rows
+        self.pending = {}
+        self.size = 0
+        self.closed = False
+        self.thread = None
+        atexit.register(self.close)
+
+    def append(self, table, row):
+        with self.condition:
+            self.pending.setdefault(table, []).append(row)
+            self.size += 1
+            full = self.size >= self.flush_size
+            if self.flush_interval is not None and self.thread is None \
+                    and not self.closed:
+                self.thread = threading.Thread(
+                    target=self._run, name='write-buffer', daemon=True)
+                self.thread.start()
+            if full:
+                self.condition.notify()
+
+        if full and self.thread is None:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.size < self.flush_size and not self.closed:
+                    self.condition.wait(self.flush_interval)
+                if self.closed:
+                    return
+            self.flush()
+
+    def _take(self):
+        with self.condition:
+            pending, self.pending, self.size = self.pending, {}, 0
+        return pending
+
+    def _restore(self, pending):
+        # put rows that failed to be written in front of the new ones
+        with self.condition:
+            for table, rows in pending.items():
+                self.pending[table] = rows + self.pending.get(table, [])
+            self.size = sum(len(rows) for rows in self.pending.values())
+            for table, rows in self.pending.items():
+                if self.size <= self.max_pending:
+                    break
+                dropped = min(len(rows), self.size - self.max_pending)
+                del rows[:dropped]
+                self.size -= dropped
+                logger.error('write buffer full, dropped %d %s rows',
+                             dropped, table.name)
+
+    def flush(self):
+        '''
+        flush()
+            writes the buffered rows, returns the number of rows written
+        '''
+        with self.flush_lock:
+            pending = self._take()
+            if not pending:
+                return 0
+
+            if has_app_context():
+                return self._flush(pending)
+            with self.app.app_context():
+                return self._flush(pending)
+
+    def _flush(self, pending):
+        try:
+            self._write(pending)
+        except OperationalError:
+            logger.exception('write buffer flush failed')
+            self._restore(pending)
+            return 0
+        except Exception:
+            logger.exception('write buffer batch rejected, writing its rows '
+                             'one by one')
+            return self._write_rows(pending)
+        return sum(len(rows) for rows in pending.values())
+
+    def _write_rows(self, pending):
+        # write the rows of a rejected batch one by one, dropping the rows
+        # the database rejects
+        rows = [(table, row) for table, table_rows in pending.items()
+                for row in table_rows]
+        written = 0
+        for index, (table, row) in enumerate(rows):
+            try:
+                self._write({table: [row]})
+            except OperationalError:
+                logger.exception('write buffer flush failed')
+                remaining = {}
+                for table, row in rows[index:]:
+                    remaining.setdefault(table, []).append(row)
+                self._restore(remaining)
+                return written
+            except Exception:
+                logger.exception('write buffer dropped a rejected %s row',
+                                 table.name)
+            else:
+                written += 1
+        return written
+
+    def _write(self, pending):
+        session = self.db.session
+        try:
+            for table, rows in pending.items():
+                session.execute(table.insert(), rows)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    def close(self):
+        # stop the background thread and write what is left
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
@@ -1,12 +1,50 @@
 import os
-from flask import Flask, request, abort, jsonify
+import json
+import base64
+import binascii
+import bisect
+from datetime import datetime
+from flask import Flask, Response, current_app, request, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from sqlalchemy import func
 
-from db.models import setup_db, Question, Category
+from db.models import (setup_db, db, database_path, Question, QuizAttempt,
+                       QuizScore,
+                       category_cache, category_questions_cache,
+                       category_stats_cache,
+                       question_pool, search_index, answer_cache,
+                       format_question_rows)
+from db.cache import make_etag
+from db.dedupe import question_hash
+from db.question_pool import ExcludeAll
+from db.write_buffer import WriteBuffer
+from flaskr.admission import init_admission
+from flaskr.answers import answer_forms, check_answer
+from flaskr.commands import init_commands
+from flaskr.metrics import CONTENT_TYPE, init_metrics, format_metrics
+from flaskr.quiz import QuizSessionStore, adaptive_difficulties
+from flaskr.serialization import init_json, jsonify
 
 QUESTIONS_PER_PAGE = 10
+# most scores returned by the leaderboard
+LEADERBOARD_LIMIT = 100
+# most quiz questions returned by one request
+QUIZ_PREFETCH_LIMIT = 10
+# most questions created or deleted by one bulk request
+BULK_LIMIT = 10000
+# content types of newline delimited JSON bodies
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson',
+                    'application/jsonl')
+
+# largest value of the 32-bit integer columns
+INTEGER_MAX = 2 ** 31 - 1
+
+# values of a boolean query argument taken as true
+TRUE_ARGS = ('1', 'true', 'yes')
+
+# backends answering the question search
+SEARCH_BACKENDS = ('sql', 'index')
 
 # Utility function for handling pagination
 
@@ -14,18 +52,533 @@ QUESTIONS_PER_PAGE = 10
 def paginate_questions(request, selection):
     page = request.args.get('page', 1, type=int)
     start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
+    # pages before the first one are always empty
+    if start < 0:
+        return []
+
+    # let the database apply LIMIT/OFFSET so that only the rows of the
+    # requested page are loaded and formatted
+    current_questions = format_question_rows(
+        selection.offset(start).limit(QUESTIONS_PER_PAGE))
 
     return current_questions
 
 
+# Utility functions for keyset (cursor) pagination
+#
+# A cursor is the opaque, url safe encoding of the id of the last question
+# returned. The next page is read with "id > last id" so the database can
+# seek through the primary key index instead of skipping OFFSET rows.
+
+
+def encode_cursor(question_id):
+    return base64.urlsafe_b64encode(
+        str(question_id).encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        question_id = int(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, binascii.Error):
+        abort(400)
+
+    if question_id < 0:
+        abort(400)
+
+    return question_id
+
+
+def paginate_questions_by_cursor(request, selection):
+    cursor = request.args.get('cursor', '')
+    last_id = decode_cursor(cursor) if cursor else 0
+
+    # fetch one extra row to find out whether there is a next page
+    current_questions = format_question_rows(
+        selection.filter(Question.id > last_id).limit(QUESTIONS_PER_PAGE + 1))
+
+    next_cursor = None
+    if len(current_questions) > QUESTIONS_PER_PAGE:
+        current_questions = current_questions[:QUESTIONS_PER_PAGE]
+        next_cursor = encode_cursor(current_questions[-1]['id'])
+
+    return current_questions, next_cursor
+
+
+# Utility function choosing between page and cursor pagination
+#
+# Requests carrying a "cursor" argument (an empty one starts from the
+# beginning) are paginated by keyset and get a "next_cursor" in the response,
+# all other requests keep using the "page" argument. The selection must be
+# ordered by Question.id.
+
+
+def paginate(request, selection):
+    if 'cursor' in request.args:
+        current_questions, next_cursor = paginate_questions_by_cursor(
+            request, selection)
+        return current_questions, {"next_cursor": next_cursor}
+
+    return paginate_questions(request, selection), {}
+
+
+# Utility function paginating a sorted list of question ids
+#
+# Used with the search index: the page (or cursor) is cut from the ids in
+# memory and only the questions of the page are loaded, by primary key.
+
+
+def paginate_ids(request, question_ids):
+    pagination = {}
+    if 'cursor' in request.args:
+        cursor = request.args.get('cursor', '')
+        last_id = decode_cursor(cursor) if cursor else 0
+        start = bisect.bisect_right(question_ids, last_id)
+        page_ids = question_ids[start:start + QUESTIONS_PER_PAGE]
+        next_cursor = None
+        if start + QUESTIONS_PER_PAGE < len(question_ids):
+            next_cursor = encode_cursor(page_ids[-1])
+        pagination = {"next_cursor": next_cursor}
+    else:
+        page = request.args.get('page', 1, type=int)
+        start = (page - 1) * QUESTIONS_PER_PAGE
+        page_ids = []
+        if start >= 0:
+            page_ids = question_ids[start:start + QUESTIONS_PER_PAGE]
+
+    current_questions = []
+    if page_ids:
+        current_questions = format_question_rows(Question.query.filter(
+            Question.id.in_(page_ids)).order_by(Question.id))
+
+    return current_questions, pagination
+
+
+# Utility function for ranking search results
+#
+# On Postgres matches are ordered by trigram similarity to the search term,
+# other databases keep the id order.
+
+
+def rank_search_results(selection, search_term):
+    if db.engine.dialect.name == 'postgresql':
+        return selection.order_by(
+            func.similarity(Question.question, search_term).desc(),
+            Question.id)
+
+    return selection.order_by(Question.id)
+
+
+# Utility function for counting the rows of a question query
+
+
+def count_questions(selection):
+    # ordering does not change the count, drop it so the database can
+    # answer the COUNT without sorting
+    return selection.order_by(None).count()
+
+
+# Utility function for validating a new question
+#
+# Returns the columns of the question, or None if a field is missing or
+# empty.
+
+
+def question_fields(body):
+    fields = {
+        'question': body.get('question', None),
+        'answer': body.get('answer', None),
+        'category': body.get('category', None),
+        'difficulty': body.get('difficulty', None),
+    }
+    if not all(fields.values()):
+        return None
+    return fields
+
+
+# Utility function for finding duplicates of new questions
+#
+# Returns one {"index", "duplicate_of"} per question whose normalized text
+# matches an existing question, with the id of that question, or an
+# earlier question of the list, with its index as "duplicate_of_index".
+
+
+def find_duplicate_questions(rows):
+    hashes = [question_hash(row['question']) for row in rows]
+    existing = Question.find_duplicates(hashes)
+    first_index = {}
+    duplicates = []
+    for index, hash in enumerate(hashes):
+        if hash in existing:
+            duplicates.append({"index": index,
+                               "duplicate_of": existing[hash]})
+        elif hash in first_index:
+            duplicates.append({"index": index,
+                               "duplicate_of_index": first_index[hash]})
+        else:
+            first_index[hash] = index
+    return duplicates
+
+
+# Utility function choosing the response of the single question writes
+#
+# "minimal" answers with the affected id and the total number of questions
+# only, "representation" adds the first page of questions like before. The
+# client picks with "Prefer: return=minimal|representation" (RFC 7240) or
+# the "return" argument, else the WRITE_RESPONSE config key applies.
+
+WRITE_RESPONSES = ('minimal', 'representation')
+
+
+def write_response_mode(request):
+    mode = request.args.get('return')
+    if mode is None:
+        for preference in request.headers.get('Prefer', '').split(','):
+            name, _, value = preference.strip().partition('=')
+            if name.strip().lower() == 'return':
+                mode = value.strip().strip('"').lower()
+    if mode not in WRITE_RESPONSES:
+        mode = current_app.config['WRITE_RESPONSE']
+    return mode
+
+
+# Utility function for the answer of a question
+#
+# Returns the answer and its normalized forms, computed once per question
+# and kept in the answer cache, or None if the question does not exist.
+
+
+def question_answer(question_id):
+    generation = answer_cache.generation(question_id)
+    entry = answer_cache.get(question_id, None)
+    if entry is None:
+        row = db.session.query(Question.answer).filter(
+            Question.id == question_id).first()
+        if row is None:
+            return None
+        entry = (row.answer, answer_forms(row.answer or ''))
+        answer_cache.set(question_id, None, entry, generation)
+    return entry
+
+
+# Utility function for reading the items of a bulk request
+#
+# The body is either a JSON array, or one JSON document per line when sent
+# as NDJSON. Unreadable bodies abort with 400, too many items with 413.
+
+
+def bulk_items(request):
+    if request.mimetype in NDJSON_MIMETYPES:
+        try:
+            items = [json.loads(line) for line
+                     in request.get_data(as_text=True).splitlines()
+                     if line.strip()]
+        except ValueError:
+            abort(400)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            abort(400)
+
+    if len(items) > BULK_LIMIT:
+        abort(413)
+    return items
+
+
+# Utility functions for picking quiz questions
+#
+# The ids are sampled from the in-memory question pool so only the chosen
+# questions are loaded from the database, with one query. A category of 0
+# means all categories. The difficulties are tried in order, None stands for
+# any difficulty.
+
+
+def pick_quiz_question_ids(category, previous, picked, count, difficulties):
+    # up to count ids in neither previous nor picked, added to picked
+    exclude = ExcludeAll(previous, picked)
+    question_ids = []
+    for difficulty in difficulties:
+        while len(question_ids) < count:
+            question_id = question_pool.choose(category, exclude, difficulty)
+            if question_id is None:
+                break
+            question_ids.append(question_id)
+            picked.add(question_id)
+    return question_ids
+
+
+def pick_quiz_questions(category_id, previous, count, difficulties=(None,)):
+    '''
+    pick_quiz_questions(category_id, previous, count, difficulties)
+        generator picking up to count questions not in previous; yields
+        the ids of the questions to load, is sent back the loaded questions
+        by id and returns them in the order they were picked
+    '''
+    category = None if category_id == 0 else category_id
+    # never pick a question twice
+    picked = set()
+
+    questions = []
+    while len(questions) < count:
+        question_ids = pick_quiz_question_ids(
+            category, previous, picked, count - len(questions), difficulties)
+        if not question_ids:
+            break
+
+        found = yield question_ids
+        for question_id in question_ids:
+            if question_id in found:
+                questions.append(found[question_id])
+            else:
+                # the question was deleted by another process, forget it and
+                # pick another one
+                question_pool.remove(question_id)
+
+    return questions
+
+
+def run_quiz_generator(generator, load):
+    # runs pick_quiz_questions() or quiz_round(), loading the questions with
+    # load(question_ids), and returns what the generator returns
+    try:
+        question_ids = next(generator)
+        while True:
+            question_ids = generator.send(load(question_ids))
+    except StopIteration as stop:
+        return stop.value
+
+
+def load_quiz_questions(question_ids):
+    selection = Question.query.filter(Question.id.in_(question_ids))
+    return {question.id: question for question in selection}
+
+
+def load_quiz_question_rows(question_ids):
+    selection = Question.query.filter(Question.id.in_(question_ids))
+    return {row['id']: row for row in format_question_rows(selection)}
+
+
+def choose_quiz_questions(category_id, previous_questions, count,
+                          difficulties=(None,)):
+    # sets are used as they are
+    previous = previous_questions
+    if isinstance(previous_questions, list):
+        previous = set(previous_questions)
+    return run_quiz_generator(
+        pick_quiz_questions(int(category_id), previous, count, difficulties),
+        load_quiz_questions)
+
+
+def choose_quiz_question(category_id, previous_questions,
+                         difficulties=(None,)):
+    questions = choose_quiz_questions(category_id, previous_questions, 1,
+                                      difficulties)
+    return questions[0] if questions else None
+
+
+# Utility function for the difficulties of the next quiz question
+#
+# The default "random" mode ignores the difficulty. The "adaptive" mode
+# follows the correctness of the recent answers ("results", one boolean per
+# previous question) starting from the difficulty of the last question.
+# Raises ValueError for an unknown mode or invalid results.
+
+
+def quiz_difficulties(body, previous_questions):
+    mode = body.get('mode', 'random')
+    if mode == 'random':
+        return (None,)
+    if mode != 'adaptive':
+        raise ValueError('unknown quiz mode {!r}'.format(mode))
+
+    results = body.get('results', [])
+    if not isinstance(results, list):
+        raise ValueError('results must be a list')
+
+    last_difficulty = None
+    if previous_questions:
+        last_difficulty = question_pool.difficulty(previous_questions[-1])
+    return adaptive_difficulties(last_difficulty, results)
+
+
+# Utility function for a round of the quiz
+#
+# POST /quizzes is served by the Flask app and by the async route of the
+# ASGI mode, both run this generator with their own way of loading the
+# questions, see pick_quiz_questions() and run_quiz_generator().
+
+
+def is_integer(value):
+    # JSON integer fitting the integer columns, bool is an int in Python
+    return (isinstance(value, int) and not isinstance(value, bool) and
+            0 <= value <= INTEGER_MAX)
+
+
+def result_category_id(body):
+    '''
+    result_category_id(body)
+        returns the id of the quiz_category of a quiz result body, 0 for
+        all categories; raises ValueError for an invalid category
+    '''
+    quiz_category = body.get('quiz_category') or {'id': 0}
+    try:
+        category_id = quiz_category['id']
+        if isinstance(category_id, bool):
+            raise ValueError('the category id must be an integer')
+        category_id = int(category_id)
+    except (TypeError, KeyError) as error:
+        raise ValueError(error)
+    if not 0 <= category_id <= INTEGER_MAX:
+        raise ValueError('the category id is out of range')
+    return category_id
+
+
+def quiz_include_answer(body, default):
+    '''
+    quiz_include_answer(body, default)
+        returns whether the quiz questions sent to the client contain their
+        answer: the include_answer flag of the body, else the default of the
+        QUIZ_INCLUDE_ANSWERS config; raises ValueError for a flag that is not
+        a boolean
+    '''
+    include_answer = body.get('include_answer', default)
+    if not isinstance(include_answer, bool):
+        raise ValueError('include_answer must be a boolean')
+    return include_answer
+
+
+def quiz_question(question, include_answer):
+    # question dictionary of a quiz response, without the answer when the
+    # client checks answers with POST /quizzes/answer
+    if include_answer or question is None:
+        return question
+    return {key: value for key, value in question.items() if key != 'answer'}
+
+
+def quiz_round(body, include_answers=True):
+    '''
+    quiz_round(body, include_answers)
+        generator validating the body of POST /quizzes, picking the
+        questions and returning the response dictionary; include_answers is
+        the QUIZ_INCLUDE_ANSWERS config; raises ValueError for an invalid
+        body
+    '''
+    if not isinstance(body, dict):
+        raise ValueError('the body must be an object')
+
+    # get previous questions and quiz category from request body
+    previous_questions = body.get('previous_questions')
+    quiz_category = body.get('quiz_category')
+    if not isinstance(previous_questions, list):
+        raise ValueError('previous_questions must be a list')
+    try:
+        category_id = int(quiz_category['id'])
+        previous = set(previous_questions)
+    except (TypeError, KeyError) as error:
+        raise ValueError(error)
+
+    # number of questions to return, more than one lets the client play
+    # several rounds without waiting for the network
+    count = body.get('count', 1)
+    if (not isinstance(count, int) or isinstance(count, bool) or
+            not 0 < count <= QUIZ_PREFETCH_LIMIT):
+        raise ValueError('count must be between 1 and {}'.format(
+            QUIZ_PREFETCH_LIMIT))
+    include_answer = quiz_include_answer(body, include_answers)
+
+    # pick random questions of the selected category (or of all categories
+    # if "All" is selected by user) except the ones listed in previous
+    # questions, of the difficulty the mode asks for
+    difficulties = quiz_difficulties(body, previous_questions)
+    questions = yield from pick_quiz_questions(category_id, previous, count,
+                                               difficulties)
+    questions = [quiz_question(question, include_answer)
+                 for question in questions]
+
+    # the questions after the first one are only listed for clients asking
+    # for a count
+    result = {
+        "success": True,
+        "question": questions[0] if questions else None,
+    }
+    if 'count' in body:
+        result["questions"] = questions
+    return result
+
+
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    app.config.from_mapping(
+        # database the app connects to, TRIVIA_DATABASE_PATH (such as a
+        # SQLite URI) overrides the Postgres default for flask run and the
+        # ASGI server
+        DATABASE_PATH=os.environ.get('TRIVIA_DATABASE_PATH', database_path),
+        # JSON encoder of the responses: "auto", "orjson" or "json"
+        JSON_BACKEND='auto',
+        # answer with MessagePack to clients accepting it, see
+        # flaskr/serialization.py
+        MSGPACK=True,
+        # maximum number of quiz sessions kept in memory
+        QUIZ_SESSION_LIMIT=10000,
+        # seconds after which an unused quiz session expires
+        QUIZ_SESSION_TTL=3600,
+        # admission control, see flaskr/admission.py
+        ADMISSION_CONTROL=True,
+        ADMISSION_DEFAULT_LIMIT=16,
+        ADMISSION_ROUTE_LIMITS={
+            'generate_random_quiz_question': 32,
+            'create_or_search_question': 8,
+        },
+        ADMISSION_QUEUE_SIZE=64,
+        ADMISSION_QUEUE_TIMEOUT=2.0,
+        ADMISSION_RETRY_AFTER=1,
+        # request metrics served at /metrics
+        METRICS=True,
+        # question search: "sql" (ILIKE) or "index" (in-memory index)
+        SEARCH_BACKEND='sql',
+        # quiz results are written in bulk: rows per flush, seconds between
+        # flushes (None to flush only when full) and rows kept on failure
+        RESULT_FLUSH_SIZE=500,
+        RESULT_FLUSH_INTERVAL=1.0,
+        RESULT_MAX_PENDING=100000,
+        # response of question writes without a preference, see
+        # write_response_mode()
+        WRITE_RESPONSE='minimal',
+        # True to let new questions repeat the text of existing ones
+        ALLOW_DUPLICATE_QUESTIONS=False,
+        # True to send the answer with the quiz questions, by default the
+        # client checks answers with POST /quizzes/answer
+        QUIZ_INCLUDE_ANSWERS=False,
+    )
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    if app.config['SEARCH_BACKEND'] not in SEARCH_BACKENDS:
+        raise ValueError('unknown SEARCH_BACKEND {!r}'.format(
+            app.config['SEARCH_BACKEND']))
+    if app.config['WRITE_RESPONSE'] not in WRITE_RESPONSES:
+        raise ValueError('unknown WRITE_RESPONSE {!r}'.format(
+            app.config['WRITE_RESPONSE']))
+    setup_db(app, app.config['DATABASE_PATH'])
+    init_json(app)
+    init_commands(app)
+
+    quiz_sessions = QuizSessionStore(app.config['QUIZ_SESSION_LIMIT'],
+                                     app.config['QUIZ_SESSION_TTL'])
+
+    # buffer of quiz attempts and scores, written outside of the requests
+    results = WriteBuffer(app, db, app.config['RESULT_FLUSH_SIZE'],
+                          app.config['RESULT_FLUSH_INTERVAL'],
+                          app.config['RESULT_MAX_PENDING'])
+    app.extensions['result_buffer'] = results
+
+    # time every request, including the ones rejected by admission control
+    metrics = init_metrics(app)
+
+    # limit the concurrent requests of every route, shedding the excess
+    admission = init_admission(
+        app, exempt=('get_admission_stats', 'get_metrics'))
 
     '''
     @TODO COMPLETED: Set up CORS(Cross Origin Resource Sharing).
@@ -53,22 +606,39 @@ def create_app(test_config=None):
     '''
     @app.route('/categories')
     def get_categories():
-        categories = Category.query.order_by(Category.id).all()
+        # get the categories dictionary and its etag from the category cache
+        categories_dict, etag = category_cache.get_with_etag()
 
         # abort if no categories found
-        if len(categories) == 0:
+        if len(categories_dict) == 0:
             abort(404)
 
-        # add all categories to dictionary so that the information can be send as part of response object
-        categories_dict = {}
-        for category in categories:
-            categories_dict[category.id] = category.type
-
-        # return the result in json format
-        return jsonify({
+        result = {
             "success": True,
             "categories": categories_dict
-        })
+        }
+
+        # add the question counts and difficulty histograms of every
+        # category on request, from the cached aggregate of all questions
+        if request.args.get('counts', '').lower() in TRUE_ARGS:
+            stats, stats_etag = category_stats_cache.get_with_etag()
+            empty = {'total': 0, 'difficulties': {}}
+            result["question_counts"] = {
+                category_id: stats.get(category_id, empty)['total']
+                for category_id in categories_dict}
+            result["difficulties"] = {
+                category_id: stats.get(category_id, empty)['difficulties']
+                for category_id in categories_dict}
+            etag = make_etag([etag, stats_etag])
+
+        # return the result in json format, answering with 304 Not Modified
+        # when the client already holds the current version
+        response = jsonify(result)
+        # the JSON and MessagePack representations differ in their etag
+        if response.mimetype != app.config['JSONIFY_MIMETYPE']:
+            etag = make_etag([etag, response.mimetype])
+        response.set_etag(etag)
+        return response.make_conditional(request)
 
     '''
     @TODO COMPLETED:
@@ -79,22 +649,22 @@ def create_app(test_config=None):
     '''
     @app.route('/questions')
     def get_questions():
-        # query all questions and keep a count of total questions
-        selection = Question.query.order_by(Question.id).all()
-        total_questions = len(selection)
+        # build the question query, pagination is applied by the database
+        selection = Question.query.order_by(Question.id)
 
         # apply pagination
-        current_questions = paginate_questions(request, selection)
+        current_questions, pagination = paginate(request, selection)
 
         # abort if no questions to be shown for the current paginated page
         if len(current_questions) == 0:
             abort(404)
 
-        # add all categories to dictionary so that the information can be send as part of response object
-        categories = Category.query.order_by(Category.id).all()
-        categories_dict = {}
-        for category in categories:
-            categories_dict[category.id] = category.type
+        # keep a count of total questions
+        total_questions = count_questions(selection)
+
+        # get the categories dictionary from the category cache so that it
+        # can be sent as part of the response object
+        categories_dict = category_cache.get()
 
         # return the result in json format
         return jsonify({
@@ -103,6 +673,7 @@ def create_app(test_config=None):
             "total_questions": total_questions,
             "categories": categories_dict,
             "current_category": None,
+            **pagination,
         })
 
     '''
@@ -134,20 +705,22 @@ def create_app(test_config=None):
             # delete the question as returned by the filtered query
             question.delete()
 
-            # prepare the information so that it can be send as part of response object
-            selection = Question.query.order_by(Question.id).all()
-            total_questions = len(selection)
+            # the total number of questions comes from the question pool
+            # which is kept up to date by the write
+            result = {
+                "success": True,
+                "deleted": question_id,
+                "total_questions": question_pool.count(),
+            }
 
-            # apply pagination
-            current_questions = paginate_questions(request, selection)
+            # add the requested page (first by default) for legacy clients
+            mode = write_response_mode(request)
+            if mode == 'representation':
+                result["questions"] = paginate_questions(
+                    request, Question.query.order_by(Question.id))
 
             # return the result in json format
-            return jsonify({
-                "success": True,
-                "deleted": question_id,
-                "questions": current_questions,
-                "total_questions": total_questions,
-            })
+            return jsonify(result), {'Preference-Applied': 'return=' + mode}
 
         except:
             abort(422)
@@ -173,19 +746,34 @@ def create_app(test_config=None):
         Try using the word "title" to start.
         '''
         if search_term:
-            # query the database table for search term
-            selection = Question.query.filter(
-                Question.question.ilike('%{}%'.format(search_term))).all()
+            if app.config['SEARCH_BACKEND'] == 'index':
+                # look the search term up in the in-memory index, the
+                # matches are in id order, and load only the page questions
+                question_ids = search_index.search(search_term)
+                current_questions, pagination = paginate_ids(request,
+                                                             question_ids)
+                total_questions = len(question_ids)
+            else:
+                # query the database table for search term, ranking the
+                # matches unless the client pages by cursor which requires
+                # the id order
+                selection = Question.search(search_term)
+                if 'cursor' in request.args:
+                    selection = selection.order_by(Question.id)
+                else:
+                    selection = rank_search_results(selection, search_term)
+
+                # apply pagination
+                current_questions, pagination = paginate(request, selection)
+                total_questions = None
 
             # abort if the search query does not return any result
-            if(len(selection) == 0):
+            if len(current_questions) == 0:
                 abort(404)
 
-            # apply pagination
-            current_questions = paginate_questions(request, selection)
-
-            # get the total number of questions
-            total_questions = len(current_questions)
+            # get the total number of matching questions
+            if total_questions is None:
+                total_questions = count_questions(selection)
 
             # return the result in json format
             return jsonify({
@@ -193,6 +781,7 @@ def create_app(test_config=None):
                 "questions": current_questions,
                 "total_questions": total_questions,
                 "current_category": None,
+                **pagination,
             })
         else:
             '''
@@ -205,41 +794,104 @@ def create_app(test_config=None):
             the form will clear and the question will appear at the end of the
             last page of the questions list in the "List" tab.
             '''
-            # get data from the body of the request object
-            new_question = body.get('question', None)
-            new_answer = body.get('answer', None)
-            new_category = body.get('category', None)
-            new_difficulty = body.get('difficulty', None)
-
-            # check if all fields contain data
-            if((not new_question) or
-                (not new_answer) or
-                (not new_category) or
-                    (not new_difficulty)):
+            # get data from the body of the request object and check if all
+            # fields contain data
+            fields = question_fields(body)
+            if fields is None:
                 abort(422)
 
+            # reject a question whose normalized text already exists
+            if not app.config['ALLOW_DUPLICATE_QUESTIONS']:
+                duplicates = find_duplicate_questions([fields])
+                if duplicates:
+                    return jsonify({
+                        "success": False,
+                        "error": 409,
+                        "message": "duplicate question",
+                        "duplicate_of": duplicates[0]["duplicate_of"],
+                    }), 409
+
             # create and insert new question in the database
-            question = Question(question=new_question,
-                                answer=new_answer,
-                                difficulty=new_difficulty,
-                                category=new_category)
+            question = Question(**fields)
             question.insert()
 
-            # get all questions and apply pagination
-            selection = Question.query.order_by(Question.id).all()
-            current_questions = paginate_questions(request, selection)
-
-            # get the total number of questions
-            total_questions = len(current_questions)
-
-            # return the result in json format
-            return jsonify({
+            # the total number of questions comes from the question pool
+            # which is kept up to date by the write
+            result = {
                 "success": True,
                 "created": question.id,
                 # "question_created": question.question,
-                "questions": current_questions,
-                "total_questions": total_questions,
-            })
+                "total_questions": question_pool.count(),
+            }
+
+            # add the requested page (first by default) for legacy clients
+            mode = write_response_mode(request)
+            if mode == 'representation':
+                result["questions"] = paginate_questions(
+                    request, Question.query.order_by(Question.id))
+
+            # return the result in json format
+            return jsonify(result), {'Preference-Applied': 'return=' + mode}
+
+    # Created endpoints to create and delete many questions at once:
+    # a.create the questions of a JSON array or NDJSON body
+    # b.delete the questions whose ids are given as a JSON array or NDJSON
+    # Every request is one transaction and the response only summarizes it.
+    @app.route('/questions/bulk', methods=['POST'])
+    def create_questions_bulk():
+        items = bulk_items(request)
+
+        # abort if any question is invalid, nothing is created then
+        rows = []
+        for item in items:
+            fields = question_fields(item) if isinstance(item, dict) else None
+            if fields is None:
+                abort(422)
+            rows.append(fields)
+
+        # abort if any question repeats an existing one or an earlier one
+        # of the request, nothing is created then
+        if not app.config['ALLOW_DUPLICATE_QUESTIONS']:
+            duplicates = find_duplicate_questions(rows)
+            if duplicates:
+                return jsonify({
+                    "success": False,
+                    "error": 409,
+                    "message": "duplicate question",
+                    "duplicates": duplicates,
+                }), 409
+
+        created = Question.insert_many(rows)
+
+        # return the result in json format
+        return jsonify({
+            "success": True,
+            "created": created,
+            "total_created": len(created),
+        })
+
+    @app.route('/questions/bulk', methods=['DELETE'])
+    def delete_questions_bulk():
+        items = bulk_items(request)
+
+        # abort if any id is not an integer
+        if not all(isinstance(item, int) and not isinstance(item, bool)
+                   for item in items):
+            abort(422)
+
+        deleted = Question.delete_many(items)
+
+        # abort if none of the questions exists
+        if not deleted:
+            abort(404)
+
+        # return the result in json format
+        return jsonify({
+            "success": True,
+            "deleted": deleted,
+            "total_deleted": len(deleted),
+            "not_found": sorted(set(items) - set(deleted)),
+        })
 
     '''
     @TODO COMPLETED:
@@ -251,30 +903,44 @@ def create_app(test_config=None):
     '''
     @app.route('/categories/<int:id>/questions')
     def get_questions_by_category(id):
-        # get category by category id
-        category = Category.query.filter(Category.id == id).one_or_none()
+        # get category type by category id from the category cache
+        category_type = category_cache.get().get(id)
 
         # abort if the category id does not exist
-        if category is None:
+        if category_type is None:
             abort(404)
 
+        # serve the page from the response cache while no question of the
+        # category was inserted or deleted since it was built
+        cache_key = (request.args.get('page', 1, type=int),
+                     request.args.get('cursor'))
+        response_body = category_questions_cache.get(id, cache_key)
+        if response_body is not None:
+            return jsonify(response_body)
+
+        # read the generation before querying, see GenerationCache.set
+        generation = category_questions_cache.generation(id)
+
         # query all questions for the categoty id
         selection = Question.query.filter(
-            Question.category == category.id).all()
+            Question.category == id).order_by(Question.id)
 
         # get the total number of questions
-        total_questions = len(selection)
+        total_questions = count_questions(selection)
 
         # apply pagination
-        current_questions = paginate_questions(request, selection)
+        current_questions, pagination = paginate(request, selection)
 
         # return the result in json format
-        return jsonify({
+        response_body = {
             "success": True,
             "questions": current_questions,
             "total_questions": total_questions,
-            "current_category": category.type,
-        })
+            "current_category": category_type,
+            **pagination,
+        }
+        category_questions_cache.set(id, cache_key, response_body, generation)
+        return jsonify(response_body)
 
     '''
     @TODO COMPLETED:
@@ -289,40 +955,238 @@ def create_app(test_config=None):
     '''
     @app.route('/quizzes', methods=['POST'])
     def generate_random_quiz_question():
+        # load request body, the round is shared with the ASGI mode
+        body = request.get_json(silent=True)
         try:
-            # load request body
-            body = request.get_json()
+            result = run_quiz_generator(
+                quiz_round(body, app.config['QUIZ_INCLUDE_ANSWERS']),
+                load_quiz_question_rows)
+        except ValueError:
+            abort(422)
 
-            # get previous questions from request body
-            previous_questions = body.get('previous_questions')
-            # get quiz category from request body
-            quiz_category = body.get('quiz_category')
+        # return the result in json format
+        return jsonify(result)
 
-            # abort if previous questions and quiz category not found
-            if((previous_questions is None) or (quiz_category is None)):
-                abort(422)
+    # Created endpoints to play a quiz with server side state:
+    # a.start a quiz session for a category
+    # b.get the next question of a session, the questions already served are
+    #   remembered by the session so the client does not send previous
+    #   questions
+    # c.end a quiz session
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        body = request.get_json(silent=True) or {}
+        quiz_category = body.get('quiz_category')
 
-            # if category "All" is selected by user, load all questions except the ones listed in previous questions
-            if(quiz_category['id'] == 0):
-                available_questions = Question.query.filter(
-                    Question.id.notin_(previous_questions)).all()
-            # load questions for selected category except the ones listed in previous questions
-            else:
-                available_questions = Question.query.filter_by(
-                    category=quiz_category['id']).filter(
-                        Question.id.notin_(previous_questions)).all()
+        # abort if quiz category not found or invalid
+        try:
+            category_id = int(quiz_category['id'])
+        except (TypeError, KeyError, ValueError):
+            abort(422)
 
-            # pick a random question from list of available questions
-            quiz_question = available_questions[random.randrange(0, len(available_questions))].format() if len(available_questions) > 0 else None
+        session = quiz_sessions.create(category_id)
+        category = None if category_id == 0 else category_id
 
-            # return the result in json format
-            return jsonify({
-                "success": True,
-                "question": quiz_question,
-            })
-        except:
+        # return the result in json format
+        return jsonify({
+            "success": True,
+            "session_id": session.id,
+            "total_questions": question_pool.count(category),
+        })
+
+    @app.route('/quizzes/sessions/<session_id>/questions', methods=['POST'])
+    def next_quiz_session_question(session_id):
+        session = quiz_sessions.get(session_id)
+
+        # abort if the session does not exist or has expired
+        if session is None:
+            abort(404)
+
+        # the body is optional, it may only carry the include_answer flag
+        body = request.get_json(silent=True) or {}
+        try:
+            include_answer = quiz_include_answer(
+                body, app.config['QUIZ_INCLUDE_ANSWERS'])
+        except ValueError:
             abort(422)
 
+        # pick and remember the question under the session lock so that
+        # concurrent requests of one session never get the same question
+        with session.lock:
+            question = None
+            while question is None:
+                question_id = session.next_question_id(question_pool)
+                if question_id is None:
+                    break
+                question = Question.query.get(question_id)
+                if question is None:
+                    # the question was deleted by another process
+                    question_pool.remove(question_id)
+            if question is not None:
+                session.seen.add(question.id)
+
+        # return the result in json format
+        return jsonify({
+            "success": True,
+            "session_id": session.id,
+            "question": quiz_question(
+                question.format() if question is not None else None,
+                include_answer),
+            "played_questions": len(session.seen),
+        })
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def delete_quiz_session(session_id):
+        # abort if the session does not exist or has expired
+        if not quiz_sessions.delete(session_id):
+            abort(404)
+
+        # return the result in json format
+        return jsonify({
+            "success": True,
+            "deleted": session_id,
+        })
+
+    # Created an endpoint to check the answer to a quiz question on the
+    # server, forgiving case, punctuation, articles and small typos
+    @app.route('/quizzes/answer', methods=['POST'])
+    def check_quiz_answer():
+        body = request.get_json(silent=True) or {}
+        question_id = body.get('question_id')
+        submission = body.get('answer')
+
+        # abort if the question id or the answer is missing
+        if not is_integer(question_id) or not isinstance(submission, str):
+            abort(422)
+
+        # abort if the question does not exist
+        entry = question_answer(question_id)
+        if entry is None:
+            abort(404)
+        answer, forms = entry
+
+        # the answer is only sent back to a player who found it
+        correct = check_answer(forms, submission)
+        result = {
+            "success": True,
+            "question_id": question_id,
+            "correct": correct,
+        }
+        if correct:
+            result["answer"] = answer
+
+        # return the result in json format
+        return jsonify(result)
+
+    # Created endpoints to record quiz results and read the leaderboard:
+    # a.record the answer to a quiz question
+    # b.record the final score of a quiz
+    # c.get the best scores, overall or of a category
+    # The results are appended to a buffer written in bulk, so recording does
+    # not wait for the database; they show up within RESULT_FLUSH_INTERVAL.
+    @app.route('/quizzes/attempts', methods=['POST'])
+    def record_quiz_attempt():
+        body = request.get_json(silent=True) or {}
+        question_id = body.get('question_id')
+        correct = body.get('correct')
+        player = body.get('player')
+
+        # abort if the attempt is incomplete or invalid
+        try:
+            category_id = result_category_id(body)
+        except ValueError:
+            abort(422)
+        if (not is_integer(question_id) or
+                not isinstance(correct, bool) or
+                (player is not None and not isinstance(player, str))):
+            abort(422)
+
+        results.append(QuizAttempt.__table__, {
+            'player': player,
+            'question_id': question_id,
+            'category': None if category_id == 0 else category_id,
+            'correct': correct,
+            'created_at': datetime.utcnow(),
+        })
+
+        # return the result in json format
+        return jsonify({
+            "success": True,
+        }), 202
+
+    @app.route('/quizzes/scores', methods=['POST'])
+    def record_quiz_score():
+        body = request.get_json(silent=True) or {}
+        player = body.get('player')
+        score = body.get('score')
+        total = body.get('total')
+
+        # abort if the score is incomplete or invalid
+        try:
+            category_id = result_category_id(body)
+        except ValueError:
+            abort(422)
+        if (not isinstance(player, str) or not player or
+                not is_integer(score) or not is_integer(total) or
+                score > total):
+            abort(422)
+
+        results.append(QuizScore.__table__, {
+            'player': player,
+            'category': None if category_id == 0 else category_id,
+            'score': score,
+            'total': total,
+            'created_at': datetime.utcnow(),
+        })
+
+        # return the result in json format
+        return jsonify({
+            "success": True,
+        }), 202
+
+    @app.route('/leaderboard')
+    def get_leaderboard():
+        category = request.args.get('category', type=int)
+        limit = request.args.get('limit', 10, type=int)
+
+        # abort if the limit is out of range
+        if not 0 < limit <= LEADERBOARD_LIMIT:
+            abort(400)
+
+        scores = QuizScore.leaderboard(category or None, limit).all()
+
+        # return the result in json format
+        return jsonify({
+            "success": True,
+            "scores": [score.format() for score in scores],
+            "current_category": category or None,
+        })
+
+    # Created an endpoint reporting the admission control state of every
+    # route: concurrency limit, active requests, queue depth and rejections
+    @app.route('/admission')
+    def get_admission_stats():
+        # abort if admission control is disabled
+        if admission is None:
+            abort(404)
+
+        # return the result in json format
+        return jsonify({
+            "success": True,
+            "routes": admission.stats(),
+        })
+
+    # Created an endpoint exposing request counts, latency histograms,
+    # database time per route and pool gauges in the Prometheus format
+    @app.route('/metrics')
+    def get_metrics():
+        # abort if metrics are disabled
+        if metrics is None:
+            abort(404)
+
+        body = format_metrics(metrics.snapshot(), db.engine.pool, admission)
+        return Response(body, content_type=CONTENT_TYPE)
+
     '''
     @TODO COMPLETED:
     Create error handlers for all expected errors
@@ -344,6 +1208,14 @@ def create_app(test_config=None):
             "message": "resource not found"
         }), 404
 
+    @app.errorhandler(413)
+    def request_entity_too_large(error):
+        return jsonify({
+            "success": False,
+            "error": 413,
+            "message": "request entity too large"
+        }), 413
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
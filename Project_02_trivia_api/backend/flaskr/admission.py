@@ -0,0 +1,165 @@
+import threading
+import time
+
+from flask import g, request
+
+from flaskr.serialization import jsonify
+
+'''
+Admission control
+
+Every route gets a concurrency limit. Requests above the limit wait in a
+bounded queue for at most the queue timeout; when the queue is full, or
+the wait times out, the request is rejected right away with a 503 and a
+Retry-After header instead of piling up until the database connections
+run out. Admitted requests therefore keep a stable latency under spikes.
+
+Config keys:
+    ADMISSION_CONTROL        - False to disable the limiter
+    ADMISSION_DEFAULT_LIMIT  - concurrent requests allowed per route
+    ADMISSION_ROUTE_LIMITS   - {endpoint name: limit} overrides
+    ADMISSION_QUEUE_SIZE     - requests allowed to wait per route
+    ADMISSION_QUEUE_TIMEOUT  - seconds a request may wait for a slot
+    ADMISSION_RETRY_AFTER    - seconds sent in the Retry-After header
+'''
+
+
+class Limiter:
+
+    def __init__(self, limit, queue_size, queue_timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        # admit only if a slot is free right away, without queueing or
+        # counting a rejection, so async callers can wait off the event loop
+        with self.condition:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self.condition:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+
+            # shed load right away once the queue is full
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'max_queue_depth': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
+
+
+class AdmissionController:
+
+    def __init__(self, default_limit, route_limits, queue_size,
+                 queue_timeout):
+        self.default_limit = default_limit
+        self.route_limits = dict(route_limits)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.limiters = {}
+
+    def limiter(self, endpoint):
+        limiter = self.limiters.get(endpoint)
+        if limiter is None:
+            with self.lock:
+                limiter = self.limiters.get(endpoint)
+                if limiter is None:
+                    limiter = Limiter(
+                        self.route_limits.get(endpoint, self.default_limit),
+                        self.queue_size, self.queue_timeout)
+                    self.limiters[endpoint] = limiter
+        return limiter
+
+    def stats(self):
+        return {endpoint: limiter.stats()
+                for endpoint, limiter in sorted(self.limiters.items())}
+
+
+def init_admission(app, exempt=()):
+    '''
+    init_admission(app, exempt)
+        installs the limiter in front of every route of the app except the
+        endpoints listed in exempt
+    '''
+    if not app.config['ADMISSION_CONTROL']:
+        return None
+
+    controller = AdmissionController(
+        app.config['ADMISSION_DEFAULT_LIMIT'],
+        app.config['ADMISSION_ROUTE_LIMITS'],
+        app.config['ADMISSION_QUEUE_SIZE'],
+        app.config['ADMISSION_QUEUE_TIMEOUT'])
+    app.extensions['admission'] = controller
+    retry_after = str(app.config['ADMISSION_RETRY_AFTER'])
+
+    @app.before_request
+    def admit_request():
+        # unknown urls are answered by the 404 handler without any work
+        endpoint = request.endpoint
+        if endpoint is None or endpoint in exempt:
+            return None
+
+        limiter = controller.limiter(endpoint)
+        if not limiter.acquire():
+            return jsonify({
+                "success": False,
+                "error": 503,
+                "message": "service unavailable"
+            }), 503, {'Retry-After': retry_after}
+
+        g.admission_limiter = limiter
+        return None
+
+    @app.teardown_request
+    def release_request(error=None):
+        limiter = g.pop('admission_limiter', None)
+        if limiter is not None:
+            limiter.release()
+
+    return controller
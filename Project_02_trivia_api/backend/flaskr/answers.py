@@ -0,0 +1,98 @@
+import re
+
+from db.text import normalize_words
+
+'''
+Answer checking
+
+A submitted answer is compared with the answer of the question after both
+are normalized (see db/text.py): accents, case, punctuation, leading
+articles and extra spaces do not matter, so "the palace of versailles!"
+matches "The Palace of Versailles". A few typos are forgiven as well, the
+number allowed grows with the length of the answer, and numbers must
+always match exactly.
+
+The normalized forms of an answer are computed once and cached per
+question, a check then costs a set lookup or a bounded edit distance of a
+few short strings.
+'''
+
+ARTICLES = ('a', 'an', 'the')
+
+NUMBER = re.compile(r'\d+')
+
+
+def normalize_answer(text):
+    # normalize the text and drop a leading article
+    words = normalize_words(text)
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return ' '.join(words)
+
+
+def answer_forms(answer):
+    '''
+    answer_forms(answer)
+        returns the normalized forms accepted for an answer: the whole
+        answer and, for answers with a parenthesized part or alternatives
+        separated by "/", each of them
+    '''
+    forms = {normalize_answer(answer)}
+    without_parentheses = re.sub(r'\(.*?\)', ' ', answer)
+    forms.add(normalize_answer(without_parentheses))
+    if '/' in answer:
+        forms.update(normalize_answer(part) for part in answer.split('/'))
+    forms.discard('')
+    return frozenset(forms)
+
+
+def max_typos(form):
+    # typos allowed in the letters of a form, none in short answers
+    letters = len(NUMBER.sub('', form))
+    if letters <= 3:
+        return 0
+    if letters <= 7:
+        return 1
+    return 2
+
+
+def within_edit_distance(first, second, limit):
+    # Levenshtein distance of at most limit, only the diagonal band of
+    # width 2 * limit + 1 is computed and the scan stops once it is exceeded
+    if abs(len(first) - len(second)) > limit:
+        return False
+    if len(first) > len(second):
+        first, second = second, first
+
+    previous = list(range(len(second) + 1))
+    for row, first_char in enumerate(first, 1):
+        current = [row] + [limit + 1] * len(second)
+        start = max(1, row - limit)
+        end = min(len(second), row + limit)
+        for column in range(start, end + 1):
+            cost = 0 if first_char == second[column - 1] else 1
+            current[column] = min(previous[column] + 1,
+                                  current[column - 1] + 1,
+                                  previous[column - 1] + cost)
+        if min(current[start - 1:end + 1]) > limit:
+            return False
+        previous = current
+    return previous[len(second)] <= limit
+
+
+def check_answer(forms, submission):
+    '''
+    check_answer(forms, submission)
+        returns whether the submission matches one of the normalized
+        forms of an answer
+    '''
+    submission = normalize_answer(submission)
+    if not submission:
+        return False
+    if submission in forms:
+        return True
+    # numbers ("1990", "Apollo 13") must match exactly
+    numbers = NUMBER.findall(submission)
+    return any(NUMBER.findall(form) == numbers and
+               within_edit_distance(submission, form, max_typos(form))
+               for form in forms)
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from databases import Database
+from sqlalchemy import select
+
+from db.models import Question, question_columns, question_pool
+from db.question_pool import PoolNotLoaded
+from flaskr import create_app, quiz_round
+from flaskr.serialization import (MSGPACK_MIMETYPE, get_dumps,
+                                  negotiate_msgpack, parse_accept)
+
+'''
+ASGI serving mode
+
+Quiz play produces many tiny concurrent requests that mostly wait on the
+database. In this mode POST /quizzes is served by a native async handler
+that reads from an async connection pool (asyncpg for Postgres, aiosqlite
+for SQLite) through the databases package, so one worker process can keep
+many quiz requests in flight. The round itself (validation, picking and
+response) is quiz_round() of the Flask route, only the loading differs:
+the round runs without loading the question pool, which the Flask routes
+may drop at any time, and the route loads the pool from the async pool
+and starts the round over when it finds it dropped.
+Like the Flask routes the async route goes through admission control,
+waiting for a slot on a thread instead of the event loop, and is counted
+by the request metrics. Every other route is passed to the Flask app
+through asgiref's WSGI adapter and behaves exactly as in WSGI mode. The
+adapter runs the Flask app on the default thread pool of the event loop,
+not on asgiref's single thread for thread sensitive code, so these
+requests are served concurrently as by a threaded WSGI server.
+
+Run it with an ASGI server, for example:
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+Config keys (on top of the ones read by create_app()):
+    ASYNC_ROUTES         - False to pass every route to the Flask app
+    ASYNC_DATABASE_PATH  - database of the async pool, DATABASE_PATH if None
+    ASYNC_POOL_MIN_SIZE  - minimum connections of the Postgres pool
+    ASYNC_POOL_MAX_SIZE  - maximum connections of the Postgres pool
+'''
+
+# response headers set on every response by the Flask app
+RESPONSE_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type,Authorization,true'),
+    (b'access-control-allow-methods', b'GET,PUT,PATCH,POST,DELETE,OPTIONS'),
+]
+
+
+class ThreadPoolWsgiInstance(WsgiToAsgiInstance):
+
+    # asgiref runs WSGI apps thread sensitive, all of them on one thread
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.__dict__['run_wsgi_app'].func,
+        thread_sensitive=False)
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    '''
+    ThreadPoolWsgiToAsgi(wsgi_application)
+        asgiref's WSGI adapter running every request on a thread of the
+        event loop's thread pool
+    '''
+
+    async def __call__(self, scope, receive, send):
+        await ThreadPoolWsgiInstance(self.wsgi_application)(
+            scope, receive, send)
+
+
+class TriviaASGI:
+
+    def __init__(self, flask_app, database):
+        self.flask_app = flask_app
+        self.wsgi = ThreadPoolWsgiToAsgi(flask_app)
+        self.database = database
+        self.connect_lock = None
+        self.dumps = get_dumps(flask_app)
+        self.admission = flask_app.extensions.get('admission')
+        self.metrics = flask_app.extensions.get('metrics')
+
+        # (method, path) -> (endpoint, handler), the endpoint names are the
+        # ones of the Flask routes for admission control and metrics
+        self.routes = {}
+        if flask_app.config['ASYNC_ROUTES']:
+            self.routes[('POST', '/quizzes')] = (
+                'generate_random_quiz_question',
+                self.generate_random_quiz_question)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        route = None
+        if scope['type'] == 'http':
+            route = self.routes.get((scope['method'], scope['path']))
+
+        if route is None:
+            await self.wsgi(scope, receive, send)
+        else:
+            await self.serve(route, scope, receive, send)
+
+    async def serve(self, route, scope, receive, send):
+        endpoint, handler = route
+        start = time.perf_counter()
+        # database time and queries of the request
+        query_time = [0.0, 0]
+        status = 500
+        try:
+            limiter = await self.admit(endpoint)
+            if limiter is False:
+                status = await self.respond(scope, send, {
+                    "success": False,
+                    "error": 503,
+                    "message": "service unavailable"
+                }, 503, [(b'retry-after', str(
+                    self.flask_app.config['ADMISSION_RETRY_AFTER']
+                ).encode('ascii'))])
+                return
+            try:
+                status = await handler(scope, receive, send, query_time)
+            finally:
+                if limiter is not None:
+                    limiter.release()
+        finally:
+            if self.metrics is not None:
+                self.metrics.thread_metrics().record(
+                    endpoint, scope['method'], status,
+                    time.perf_counter() - start, query_time)
+
+    async def admit(self, endpoint):
+        # returns the limiter holding a slot for the request, None without
+        # admission control or False if the request is rejected
+        if self.admission is None:
+            return None
+        limiter = self.admission.limiter(endpoint)
+        if limiter.try_acquire():
+            return limiter
+        # queue for a slot on a thread, the event loop keeps serving
+        admitted = await asyncio.get_event_loop().run_in_executor(
+            None, limiter.acquire)
+        return limiter if admitted else False
+
+    async def fetch_all(self, query, query_time):
+        start = time.perf_counter()
+        rows = await self.database.fetch_all(query)
+        query_time[0] += time.perf_counter() - start
+        query_time[1] += 1
+        return rows
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.connect()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # write the buffered quiz results before the process exits
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self.flask_app.extensions['result_buffer'].close)
+                if self.database.is_connected:
+                    await self.database.disconnect()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def connect(self):
+        # servers without lifespan support connect on the first request
+        if self.connect_lock is None:
+            self.connect_lock = asyncio.Lock()
+        async with self.connect_lock:
+            if not self.database.is_connected:
+                await self.database.connect()
+
+    async def respond(self, scope, send, payload, status=200, headers=()):
+        # MessagePack for clients preferring it, like jsonify()
+        accept = dict(scope['headers']).get(b'accept', b'').decode('latin-1')
+        packb = negotiate_msgpack(self.flask_app, parse_accept(accept))
+        if packb is not None:
+            body = packb(payload)
+            content_type = MSGPACK_MIMETYPE.encode('ascii')
+        else:
+            body = self.dumps(payload) + b'\n'
+            content_type = b'application/json'
+        headers = [
+            (b'content-type', content_type),
+            (b'content-length', str(len(body)).encode('ascii')),
+        ] + list(headers)
+        if self.flask_app.extensions['msgpack_dumps'] is not None:
+            headers.append((b'vary', b'Accept'))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers + RESPONSE_HEADERS,
+        })
+        await send({'type': 'http.response.body', 'body': body})
+        return status
+
+    async def unprocessable(self, scope, send):
+        return await self.respond(scope, send, {
+            "success": False,
+            "error": 422,
+            "message": "unprocessable"
+        }, 422)
+
+    async def generate_random_quiz_question(self, scope, receive, send,
+                                            query_time):
+        # load request body
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return await self.unprocessable(scope, send)
+
+        if not self.database.is_connected:
+            await self.connect()
+
+        while True:
+            # the question pool is shared with the Flask routes, load it
+            # from the async pool instead of a blocking query on the event
+            # loop
+            if question_pool.needs_load():
+                rows = await self.fetch_all(select(
+                    [Question.id, Question.category, Question.difficulty]),
+                    query_time)
+                question_pool.load_rows(
+                    [(row['id'], row['category'], row['difficulty'])
+                     for row in rows])
+
+            try:
+                result = await self.run_quiz_round(body, query_time)
+                break
+            except PoolNotLoaded:
+                # a Flask route dropped the pool during the round
+                continue
+            except ValueError:
+                return await self.unprocessable(scope, send)
+
+        # return the result in json format
+        return await self.respond(scope, send, result)
+
+    async def run_quiz_round(self, body, query_time):
+        # run the round of the Flask route, loading the questions it picks
+        # from the async pool; the steps of the round never load the
+        # question pool on the event loop
+        quiz = quiz_round(body,
+                          self.flask_app.config['QUIZ_INCLUDE_ANSWERS'])
+        try:
+            with question_pool.without_loading():
+                question_ids = next(quiz)
+            while True:
+                rows = await self.fetch_all(
+                    select(list(question_columns)).where(
+                        Question.id.in_(question_ids)), query_time)
+                with question_pool.without_loading():
+                    question_ids = quiz.send(
+                        {row['id']: {column.key: row[column.key]
+                                     for column in question_columns}
+                         for row in rows})
+        except StopIteration as stop:
+            return stop.value
+
+
+def create_asgi_app(test_config=None):
+    app = create_app(test_config)
+    app.config.setdefault('ASYNC_ROUTES', True)
+    app.config.setdefault('ASYNC_DATABASE_PATH', None)
+    app.config.setdefault('ASYNC_POOL_MIN_SIZE', 1)
+    app.config.setdefault('ASYNC_POOL_MAX_SIZE', 20)
+
+    database_path = (app.config['ASYNC_DATABASE_PATH'] or
+                     app.config['DATABASE_PATH'])
+    options = {}
+    if database_path.startswith('postgresql'):
+        options = {'min_size': app.config['ASYNC_POOL_MIN_SIZE'],
+                   'max_size': app.config['ASYNC_POOL_MAX_SIZE']}
+
+    return TriviaASGI(app, Database(database_path, **options))
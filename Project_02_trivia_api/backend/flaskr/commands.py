@@ -0,0 +1,55 @@
+import click
+from flask.cli import AppGroup
+
+from db.dedupe import DEDUPE_THRESHOLD, find_duplicates
+from db.models import Question, load_search_index
+
+'''
+Command line
+
+    flask questions dedupe [--threshold 0.8] [--apply]
+        lists the groups of duplicate and near-duplicate questions, see
+        db/dedupe.py, and with --apply deletes every question of a group
+        but the one with the lowest id
+'''
+
+questions_cli = AppGroup('questions', help='Manage the question bank.')
+
+
+@questions_cli.command('dedupe')
+@click.option('--threshold', default=DEDUPE_THRESHOLD, show_default=True,
+              type=click.FloatRange(0.5, 1.0),
+              help='Word similarity of near-duplicate questions.')
+@click.option('--apply', is_flag=True,
+              help='Delete the duplicates instead of only listing them.')
+def dedupe_questions(threshold, apply):
+    # questions restored from trivia.psql have no hash yet
+    backfilled = Question.backfill_hashes()
+    if backfilled:
+        click.echo('Hashed {} questions.'.format(backfilled))
+
+    rows = load_search_index()
+    texts = {question_id: question for question_id, question, _ in rows}
+    groups = find_duplicates(rows, threshold)
+    for group in groups:
+        click.echo('Keep {} {!r}'.format(group[0], texts[group[0]]))
+        for question_id in group[1:]:
+            click.echo('  duplicate {} {!r}'.format(
+                question_id, texts[question_id]))
+
+    duplicates = [question_id for group in groups
+                  for question_id in group[1:]]
+    if apply:
+        Question.delete_many(duplicates)
+        click.echo('Deleted {} duplicate questions.'.format(len(duplicates)))
+    else:
+        click.echo('Found {} duplicate questions, run with --apply to delete '
+                   'them.'.format(len(duplicates)))
+
+
+def init_commands(app):
+    '''
+    init_commands(app)
+        registers the command line of the app
+    '''
+    app.cli.add_command(questions_cli)
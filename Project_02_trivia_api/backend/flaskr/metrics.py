@@ -0,0 +1,261 @@
+import bisect
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+Request metrics
+
+Counts requests per route, method and status code, and records a latency
+histogram and the time spent in database queries per route. The numbers
+are exposed in the Prometheus text format together with connection pool
+and admission control gauges.
+
+Every thread records into its own counters without taking a lock; a
+scrape merges the counters of all threads. Counters of finished threads
+are folded into a shared total when new threads register, so the
+threaded development server does not leak one set of counters per
+request.
+
+Config keys:
+    METRICS  - False to disable the metrics
+'''
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# registered threads above which finished threads are folded away
+SWEEP_THRESHOLD = 64
+
+# endpoint label of requests that match no route
+UNMATCHED_ENDPOINT = 'unmatched'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# database time of the request handled by the current thread
+query_timer = threading.local()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if getattr(query_timer, 'current', None) is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    current = getattr(query_timer, 'current', None)
+    starts = conn.info.get('query_start')
+    if current is not None and starts:
+        current[0] += time.perf_counter() - starts.pop()
+        current[1] += 1
+
+
+class ThreadMetrics:
+
+    def __init__(self):
+        # (endpoint, method, status) -> count
+        self.requests = {}
+        # endpoint -> [count per bucket..., count above the last, sum]
+        self.latency = {}
+        # endpoint -> [seconds, queries]
+        self.queries = {}
+
+    def record(self, endpoint, method, status, elapsed, query_time):
+        key = (endpoint, method, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        histogram = self.latency.get(endpoint)
+        if histogram is None:
+            histogram = self.latency[endpoint] = \
+                [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        histogram[-1] += elapsed
+
+        totals = self.queries.get(endpoint)
+        if totals is None:
+            totals = self.queries[endpoint] = [0.0, 0]
+        totals[0] += query_time[0]
+        totals[1] += query_time[1]
+
+    def merge(self, other):
+        for key, count in list(other.requests.items()):
+            self.requests[key] = self.requests.get(key, 0) + count
+        for endpoint, histogram in list(other.latency.items()):
+            merged = self.latency.setdefault(
+                endpoint, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+            for index, value in enumerate(list(histogram)):
+                merged[index] += value
+        for endpoint, totals in list(other.queries.items()):
+            merged = self.queries.setdefault(endpoint, [0.0, 0])
+            merged[0] += totals[0]
+            merged[1] += totals[1]
+
+
+class Metrics:
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # (thread, metrics) of every thread that recorded a request
+        self.threads = []
+        # metrics of the threads that finished
+        self.retired = ThreadMetrics()
+
+    def thread_metrics(self):
+        metrics = getattr(self.local, 'metrics', None)
+        if metrics is None:
+            metrics = self.local.metrics = ThreadMetrics()
+            with self.lock:
+                if len(self.threads) >= SWEEP_THRESHOLD:
+                    self._sweep()
+                self.threads.append((threading.current_thread(), metrics))
+        return metrics
+
+    def _sweep(self):
+        # called with the lock held
+        alive = []
+        for thread, metrics in self.threads:
+            if thread.is_alive():
+                alive.append((thread, metrics))
+            else:
+                self.retired.merge(metrics)
+        self.threads = alive
+
+    def snapshot(self):
+        total = ThreadMetrics()
+        with self.lock:
+            self._sweep()
+            total.merge(self.retired)
+            for _, metrics in self.threads:
+                total.merge(metrics)
+        return total
+
+
+def format_labels(**labels):
+    return ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"'))
+                    for name, value in sorted(labels.items()))
+
+
+def format_metrics(snapshot, pool=None, admission=None):
+    '''
+    format_metrics(snapshot, pool, admission)
+        returns the metrics in the Prometheus text format
+    '''
+    lines = [
+        '# HELP trivia_http_requests_total Requests by route and status.',
+        '# TYPE trivia_http_requests_total counter',
+    ]
+    for (endpoint, method, status), count in sorted(snapshot.requests.items()):
+        lines.append('trivia_http_requests_total{{{}}} {}'.format(
+            format_labels(endpoint=endpoint, method=method, status=status),
+            count))
+
+    lines += [
+        '# HELP trivia_http_request_duration_seconds Request latency.',
+        '# TYPE trivia_http_request_duration_seconds histogram',
+    ]
+    for endpoint, histogram in sorted(snapshot.latency.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram):
+            cumulative += count
+            lines.append(
+                'trivia_http_request_duration_seconds_bucket{{{}}} {}'.format(
+                    format_labels(endpoint=endpoint, le=bound), cumulative))
+        labels = format_labels(endpoint=endpoint)
+        lines.append('trivia_http_request_duration_seconds_sum{{{}}} {}'
+                     .format(labels, histogram[-1]))
+        lines.append('trivia_http_request_duration_seconds_count{{{}}} {}'
+                     .format(labels, cumulative))
+
+    lines += [
+        '# HELP trivia_db_query_seconds_total Time spent in queries.',
+        '# TYPE trivia_db_query_seconds_total counter',
+    ]
+    for endpoint, (seconds, _) in sorted(snapshot.queries.items()):
+        lines.append('trivia_db_query_seconds_total{{{}}} {}'.format(
+            format_labels(endpoint=endpoint), seconds))
+    lines += [
+        '# HELP trivia_db_queries_total Queries executed.',
+        '# TYPE trivia_db_queries_total counter',
+    ]
+    for endpoint, (_, queries) in sorted(snapshot.queries.items()):
+        lines.append('trivia_db_queries_total{{{}}} {}'.format(
+            format_labels(endpoint=endpoint), queries))
+
+    # gauges of the connection pool, only queue pools report them all
+    for name, method, description in (
+            ('size', 'size', 'Connections kept by the pool.'),
+            ('checked_out', 'checkedout', 'Connections in use.'),
+            ('checked_in', 'checkedin', 'Idle connections.'),
+            ('overflow', 'overflow', 'Connections above the pool size.')):
+        value = getattr(pool, method, None)
+        if not callable(value):
+            continue
+        lines += [
+            '# HELP trivia_db_pool_{} {}'.format(name, description),
+            '# TYPE trivia_db_pool_{} gauge'.format(name),
+            'trivia_db_pool_{} {}'.format(name, value()),
+        ]
+
+    if admission is not None:
+        stats = admission.stats()
+        for name, key, kind, description in (
+                ('active', 'active', 'gauge', 'Requests being served.'),
+                ('queue_depth', 'queue_depth', 'gauge',
+                 'Requests waiting for a slot.'),
+                ('rejected_total', 'rejected', 'counter',
+                 'Requests rejected with a 503.')):
+            lines += [
+                '# HELP trivia_admission_{} {}'.format(name, description),
+                '# TYPE trivia_admission_{} {}'.format(name, kind),
+            ]
+            for endpoint, values in stats.items():
+                lines.append('trivia_admission_{}{{{}}} {}'.format(
+                    name, format_labels(endpoint=endpoint), values[key]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app):
+    '''
+    init_metrics(app)
+        records the latency, status and database time of every request of
+        the app; returns the Metrics object or None if disabled
+    '''
+    if not app.config['METRICS']:
+        return None
+
+    metrics = Metrics()
+    app.extensions['metrics'] = metrics
+
+    # the listeners only record while a request is timed on the thread
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        query_timer.current = [0.0, 0]
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            metrics.thread_metrics().record(
+                request.endpoint or UNMATCHED_ENDPOINT, request.method,
+                response.status_code, time.perf_counter() - start,
+                query_timer.current or (0.0, 0))
+        return response
+
+    @app.teardown_request
+    def stop_timer(error=None):
+        query_timer.current = None
+
+    return metrics
@@ -0,0 +1,170 @@
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# difficulties of the questions, from easiest to hardest
+DIFFICULTIES = (1, 2, 3, 4, 5)
+# difficulty of the first question of an adaptive quiz
+ADAPTIVE_START_DIFFICULTY = 2
+# number of recent answers the adaptive quiz looks at
+ADAPTIVE_WINDOW = 3
+
+'''
+QuizDeck
+    lazily shuffled order of the questions of a quiz session
+
+The deck is a Fisher-Yates shuffle of the positions of the category in
+the question pool carried out one draw at a time: a draw swaps a random
+undrawn position with the first undrawn one, and only the swapped
+positions are stored. A session therefore costs memory in proportion to
+the questions it played, whatever the question ids, and every draw is
+O(1). Writes to the pool move ids between positions, so an id may come
+up twice (played ids are skipped) or be passed over (found by one pass
+over the pool once the deck is empty).
+'''
+
+
+class QuizDeck:
+
+    def __init__(self):
+        self.drawn = 0
+        # position -> position moved there by a draw
+        self.swaps = {}
+
+    def draw(self, size):
+        # next position below size, None once every position was drawn
+        if self.drawn >= size:
+            return None
+        position = random.randrange(self.drawn, size)
+        first = self.swaps.pop(self.drawn, self.drawn)
+        if position == self.drawn:
+            chosen = first
+        else:
+            chosen = self.swaps.get(position, position)
+            self.swaps[position] = first
+        self.drawn += 1
+        return chosen
+
+
+'''
+adaptive_difficulties(last_difficulty, results)
+    returns the difficulties to pick the next question of an adaptive quiz
+    from, best first
+
+The difficulty of the last question goes up one level when at least two
+thirds of the recent answers were correct and down one level when less
+than a third were. Nearer difficulties, easier ones first on a tie,
+follow in case the target one has no question left.
+'''
+
+
+def adaptive_difficulties(last_difficulty, results):
+    target = ADAPTIVE_START_DIFFICULTY
+    recent = [bool(result) for result in results[-ADAPTIVE_WINDOW:]]
+    if last_difficulty is not None:
+        target = last_difficulty
+        if recent:
+            correct = sum(recent) / len(recent)
+            if correct >= 2 / 3:
+                target += 1
+            elif correct < 1 / 3:
+                target -= 1
+        target = min(max(target, DIFFICULTIES[0]), DIFFICULTIES[-1])
+
+    return sorted(DIFFICULTIES,
+                  key=lambda difficulty: (abs(difficulty - target),
+                                          difficulty))
+
+
+'''
+QuizSession
+    server side state of one quiz: the category being played, the ids of
+    the questions already served and the deck they are drawn from
+'''
+
+
+class QuizSession:
+
+    def __init__(self, session_id, category_id):
+        self.id = session_id
+        self.category_id = category_id
+        self.seen = set()
+        self.deck = QuizDeck()
+        self.lock = threading.Lock()
+        self.expires = 0
+
+    def next_question_id(self, pool):
+        '''
+        next_question_id(pool)
+            returns the id of a random question of the session category
+            from the question pool that was not served yet, None when every
+            question was served; called with the session lock held
+        '''
+        category = None if self.category_id == 0 else self.category_id
+        while True:
+            size = pool.count(category)
+            position = self.deck.draw(size)
+            if position is None:
+                # only questions passed over by moves in the pool are left
+                if len(self.seen) < size:
+                    return pool.choose(category, self.seen)
+                return None
+            question_id = pool.question_at(category, position)
+            if question_id is not None and question_id not in self.seen:
+                return question_id
+
+
+'''
+QuizSessionStore
+    bounded in-process store of quiz sessions
+
+Sessions expire after ttl seconds without use. When the store is full
+the least recently used session is evicted, so memory stays bounded no
+matter how many quizzes are started.
+'''
+
+
+class QuizSessionStore:
+
+    def __init__(self, limit, ttl):
+        self.limit = limit
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, category_id):
+        session = QuizSession(secrets.token_urlsafe(16), category_id)
+        with self.lock:
+            self._expire()
+            while len(self.sessions) >= self.limit:
+                self.sessions.popitem(last=False)
+            session.expires = time.monotonic() + self.ttl
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            self._expire()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.expires = time.monotonic() + self.ttl
+                self.sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def _expire(self):
+        # sessions are ordered by last use, expired ones are at the front
+        now = time.monotonic()
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.expires >= now:
+                break
+            self.sessions.popitem(last=False)
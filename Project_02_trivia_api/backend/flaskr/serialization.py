@@ -0,0 +1,143 @@
+import json
+import logging
+
+from flask import (current_app, has_request_context, request,
+                   jsonify as flask_jsonify)
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+'''
+JSON serialization of API responses
+
+The JSON_BACKEND config key selects the encoder used by jsonify():
+    "auto"   - orjson when it is installed, the standard library otherwise
+    "orjson" - orjson, fails at startup when it is not installed
+    "json"   - Flask's own jsonify with the standard library encoder
+
+Clients may ask for MessagePack instead of JSON with the Accept header
+(application/msgpack, or the older application/x-msgpack). jsonify() then
+encodes the same response dictionary with msgpack, whose output is smaller
+and faster to parse; map keys keep their type, so category ids are
+integers rather than strings. JSON stays the default, also for "*/*", and
+every response of jsonify() carries "Vary: Accept". Set the MSGPACK config
+key to False to always answer with JSON. msgpack is a requirement of the
+app; should it be missing anyway, a warning is logged and only JSON is
+served.
+'''
+
+JSON_BACKENDS = ('auto', 'orjson', 'json')
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+# MessagePack types understood in the Accept header
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+
+def orjson_dumps(app):
+    options = orjson.OPT_NON_STR_KEYS
+    if app.config['JSON_SORT_KEYS']:
+        options |= orjson.OPT_SORT_KEYS
+
+    def dumps(payload):
+        return orjson.dumps(payload, option=options)
+
+    return dumps
+
+
+def init_json(app):
+    backend = app.config['JSON_BACKEND']
+    if backend not in JSON_BACKENDS:
+        raise ValueError('unknown JSON_BACKEND {!r}'.format(backend))
+    if backend == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_BACKEND is "orjson" but orjson is not '
+                           'installed')
+
+    if backend != 'json' and orjson is not None:
+        app.extensions['json_dumps'] = orjson_dumps(app)
+    else:
+        app.extensions['json_dumps'] = None
+
+    if app.config['MSGPACK'] and msgpack is None:
+        logger.warning('MSGPACK is enabled but msgpack is not installed, '
+                       'answering with JSON only')
+    if app.config['MSGPACK'] and msgpack is not None:
+        app.extensions['msgpack_dumps'] = msgpack.packb
+    else:
+        app.extensions['msgpack_dumps'] = None
+
+
+def negotiate_msgpack(app, accept):
+    '''
+    negotiate_msgpack(app, accept)
+        returns the MessagePack encoder if the parsed Accept header prefers
+        MessagePack to JSON and the app offers it, else None
+    '''
+    packb = app.extensions.get('msgpack_dumps')
+    if packb is None:
+        return None
+    best = accept.best_match(
+        (app.config['JSONIFY_MIMETYPE'],) + MSGPACK_MIMETYPES)
+    return packb if best in MSGPACK_MIMETYPES else None
+
+
+def parse_accept(value):
+    # Accept header of a request handled outside of Flask
+    return parse_accept_header(value, MIMEAccept)
+
+
+def response_payload(args, kwargs):
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both '
+                        'args and kwargs')
+    if len(args) == 1:
+        return args[0]
+    return args or kwargs
+
+
+def jsonify(*args, **kwargs):
+    app = current_app._get_current_object()
+    dumps = app.extensions.get('json_dumps')
+    packb = None
+    if has_request_context():
+        packb = negotiate_msgpack(app, request.accept_mimetypes)
+
+    if packb is not None:
+        response = app.response_class(
+            packb(response_payload(args, kwargs)), mimetype=MSGPACK_MIMETYPE)
+    elif dumps is None:
+        # no fast encoder configured, keep Flask's behavior
+        response = flask_jsonify(*args, **kwargs)
+    else:
+        response = app.response_class(
+            dumps(response_payload(args, kwargs)) + b'\n',
+            mimetype=app.config['JSONIFY_MIMETYPE'])
+
+    # the encoding depends on the Accept header when MessagePack is offered
+    if app.extensions.get('msgpack_dumps') is not None:
+        response.vary.add('Accept')
+    return response
+
+
+def get_dumps(app):
+    # bytes encoder for code that builds responses outside of Flask
+    dumps = app.extensions.get('json_dumps')
+    if dumps is not None:
+        return dumps
+
+    def stdlib_dumps(payload):
+        return json.dumps(payload, separators=(',', ':'),
+                          sort_keys=app.config['JSON_SORT_KEYS']
+                          ).encode('utf-8')
+
+    return stdlib_dumps
@@ -1,24 +1,321 @@
+import asyncio
 import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+import msgpack
+from flask_migrate import stamp, upgrade
+from sqlalchemy import Integer, create_engine, event
+from werkzeug.datastructures import Headers
 
 from flaskr import create_app
-from db.models import setup_db, Question, Category
+from flaskr.quiz import QuizDeck
+from db.sqlite import is_memory_database
+from db.models import (db, create_schema, Question, Category, QuizAttempt,
+                       QuizScore, category_cache, category_questions_cache,
+                       question_pool, search_index, answer_cache,
+                       category_stats_cache)
+
+# database restored from trivia.psql that the tests run against, a SQLite
+# URI (such as "sqlite://") runs them without a database server
+TEST_DATABASE_PATH = os.environ.get(
+    'TRIVIA_TEST_DATABASE_PATH',
+    "postgresql://{}:{}@{}/{}".format(
+        'postgres', 'postgres', 'localhost:5432', 'trivia_test'))
+
+# set by pytest-xdist when the tests run in parallel workers
+WORKER = os.environ.get('PYTEST_XDIST_WORKER')
+
+# "wsgi" to test the Flask app, "asgi" to test the ASGI serving mode
+SERVER_MODE = os.environ.get('TRIVIA_TEST_SERVER_MODE', 'wsgi')
+
+# data of the test database, loaded into empty SQLite databases
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'db', 'trivia.psql')
+# migration whose schema is the one of trivia.psql
+FIXTURE_REVISION = '3c5e2a91d0b4'
+
+# shared by all tests of the module, see setUpModule
+app = None
+asgi_client = None
+worker_database_path = None
+sqlite_database_file = None
+setup_duration = 0.0
+test_durations = []
+
+
+def clone_database(database_path, worker):
+    """Create a copy of the test database for a parallel worker.
+
+    Postgres copies the template database file by file, which is much
+    faster than restoring trivia.psql and gives every worker its own data.
+    """
+    server_path, template = database_path.rsplit('/', 1)
+    clone = '{}_{}'.format(template, worker)
+    engine = create_engine(server_path + '/postgres',
+                           isolation_level='AUTOCOMMIT')
+    with engine.connect() as connection:
+        connection.execute('DROP DATABASE IF EXISTS "{}"'.format(clone))
+        connection.execute('CREATE DATABASE "{}" TEMPLATE "{}"'.format(
+            clone, template))
+    engine.dispose()
+    return '{}/{}'.format(server_path, clone)
+
+
+def prepare_sqlite_database(database_path, worker):
+    """Return the SQLite database the tests of this process run against.
+
+    The async pool of the ASGI mode cannot see an in-memory database, so
+    it is replaced by a temporary file. Parallel workers get a copy of a
+    file database.
+    """
+    global sqlite_database_file
+    if is_memory_database(database_path):
+        if SERVER_MODE != 'asgi':
+            return database_path
+        handle, sqlite_database_file = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+    elif worker:
+        source = database_path.split('///', 1)[1].split('?', 1)[0]
+        sqlite_database_file = '{}_{}.db'.format(
+            os.path.splitext(source)[0], worker)
+        if os.path.exists(source):
+            shutil.copyfile(source, sqlite_database_file)
+    else:
+        return database_path
+    return 'sqlite:///' + sqlite_database_file
+
+
+def load_fixture():
+    """Create the schema and load the data of trivia.psql.
+
+    Reads the COPY blocks of the Postgres dump so SQLite databases get the
+    same categories and questions as a restored trivia_test database. The
+    schema is created from the models, which an in-memory database needs
+    since the migrations open their own connection, and marked as current.
+    """
+    create_schema()
+    stamp(revision='head')
+    with open(FIXTURE_PATH) as fixture:
+        dump = fixture.read()
+
+    for table_name, columns, block in re.findall(
+            r'^COPY public\.(\w+) \((.*?)\) FROM stdin;\n(.*?)^\\\.$',
+            dump, re.M | re.S):
+        table = db.metadata.tables[table_name]
+        columns = [column.strip() for column in columns.split(',')]
+        rows = []
+        for line in block.splitlines():
+            row = {}
+            for column, value in zip(columns, line.split('\t')):
+                if value == '\\N':
+                    value = None
+                elif isinstance(table.c[column].type, Integer):
+                    value = int(value)
+                row[column] = value
+            rows.append(row)
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+    Question.backfill_hashes()
+
+
+def drop_database(database_path):
+    server_path, name = database_path.rsplit('/', 1)
+    engine = create_engine(server_path + '/postgres',
+                           isolation_level='AUTOCOMMIT')
+    with engine.connect() as connection:
+        connection.execute('DROP DATABASE IF EXISTS "{}"'.format(name))
+    engine.dispose()
+
+
+class AsgiTestResponse:
+
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+
+class AsgiTestClient:
+    """Minimal test client sending requests to an ASGI app.
+
+    Offers the subset of the Flask test client used by the tests. All
+    requests run on one event loop so the async connection pool is reused.
+    """
+
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+        self.loop = asyncio.new_event_loop()
+
+    def close(self):
+        if self.asgi_app.database.is_connected:
+            self.loop.run_until_complete(self.asgi_app.database.disconnect())
+        self.loop.close()
+
+    def open(self, method, url, json_body=None, headers=None, data=None,
+             content_type=None):
+        path, _, query_string = url.partition('?')
+        body = b''
+        request_headers = [(b'host', b'localhost')]
+        if json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            request_headers.append((b'content-type', b'application/json'))
+        elif data is not None:
+            body = data.encode('utf-8')
+            request_headers.append((b'content-type',
+                                    content_type.encode('latin-1')))
+        request_headers.append((b'content-length',
+                                str(len(body)).encode('latin-1')))
+        for name, value in (headers or {}).items():
+            request_headers.append((name.lower().encode('latin-1'),
+                                    value.encode('latin-1')))
+
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': '/' + path.lstrip('/'),
+            'raw_path': path.encode('latin-1'),
+            'query_string': query_string.encode('latin-1'),
+            'root_path': '',
+            'headers': request_headers,
+            'server': ('localhost', 80),
+            'client': ('127.0.0.1', 50000),
+        }
+        messages = [{'type': 'http.request', 'body': body,
+                     'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(self.asgi_app(scope, receive, send))
+
+        response_headers = Headers()
+        for name, value in sent[0]['headers']:
+            response_headers.add(name.decode('latin-1'),
+                                 value.decode('latin-1'))
+        data = b''.join(message.get('body', b'') for message in sent[1:])
+        return AsgiTestResponse(sent[0]['status'], response_headers, data)
+
+    def get(self, url, headers=None):
+        return self.open('GET', url, headers=headers)
+
+    def post(self, url, json=None, headers=None, data=None,
+             content_type=None):
+        return self.open('POST', url, json_body=json, headers=headers,
+                         data=data, content_type=content_type)
+
+    def delete(self, url, json=None, headers=None):
+        return self.open('DELETE', url, json_body=json, headers=headers)
+
+
+def setUpModule():
+    """Create the app and connect to the test database once for all tests."""
+    global app, asgi_client, worker_database_path, setup_duration
+    start = time.perf_counter()
+
+    database_path = TEST_DATABASE_PATH
+    if WORKER and database_path.startswith('postgresql'):
+        worker_database_path = clone_database(database_path, WORKER)
+        database_path = worker_database_path
+    elif database_path.startswith('sqlite'):
+        database_path = prepare_sqlite_database(database_path, WORKER)
+
+    # quiz results are only written when a test flushes them, inside the
+    # test transaction
+    config = {'DATABASE_PATH': database_path,
+              'RESULT_FLUSH_INTERVAL': None}
+    if SERVER_MODE == 'asgi':
+        from flaskr.asgi import create_asgi_app
+        asgi_app = create_asgi_app(config)
+        asgi_client = AsgiTestClient(asgi_app)
+        app = asgi_app.flask_app
+    else:
+        app = create_app(config)
+
+    # SQLite databases start empty, Postgres is restored from trivia.psql
+    # with the schema of the first migration and brought up to date
+    with app.app_context():
+        if not db.engine.has_table('questions'):
+            load_fixture()
+        else:
+            if not db.engine.has_table('alembic_version'):
+                stamp(revision=FIXTURE_REVISION)
+            upgrade()
+    setup_duration = time.perf_counter() - start
+
+
+def tearDownModule():
+    """Release the database and report the slowest tests."""
+    if asgi_client is not None:
+        asgi_client.close()
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    if worker_database_path:
+        drop_database(worker_database_path)
+    if sqlite_database_file:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(sqlite_database_file + suffix):
+                os.remove(sqlite_database_file + suffix)
+
+    total = sum(duration for _, duration in test_durations)
+    report = ['', 'trivia tests ({}{}): {} tests in {:.3f}s (setup {:.3f}s)'
+              .format(SERVER_MODE, ', {}'.format(WORKER) if WORKER else '',
+                      len(test_durations), total, setup_duration)]
+    slowest = sorted(test_durations, key=lambda item: -item[1])[:5]
+    for name, duration in slowest:
+        report.append('  {:.3f}s {}'.format(duration, name))
+    sys.stderr.write('\n'.join(report) + '\n')
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
+        """Define test variables and open a transaction for the test.
+
+        Everything the test (and the app code it calls) writes happens inside
+        a transaction that is rolled back in tearDown. Commits issued by the
+        app only release a savepoint, which is restarted right away.
+        """
+        self.started = time.perf_counter()
+        self.app = app
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        # self.database_path = "postgresql://{}/{}".format('localhost:5432', self.database_name)
-        self.database_path = "postgresql://{}:{}@{}/{}".format(
-            'postgres', 'postgres', 'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
+        if asgi_client is not None:
+            self.client = lambda: asgi_client
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.create_scoped_session(
+            options={'bind': self.connection, 'binds': {}})
+        self.original_session = db.session
+        db.session = self.session
+
+        self.session.begin_nested()
+
+        @event.listens_for(self.session, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
 
         # sample question to be used for test
         self.new_question = {
@@ -28,16 +325,23 @@ class TriviaTestCase(unittest.TestCase):
             'category': '3',
         }
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        self.session.remove()
+        self.transaction.rollback()
+        self.connection.close()
+        db.session = self.original_session
+        self.app_context.pop()
+
+        # in-memory caches may hold rows written by the rolled back test
+        category_cache.invalidate()
+        category_stats_cache.invalidate()
+        category_questions_cache.clear()
+        question_pool.invalidate()
+        search_index.invalidate()
+        answer_cache.clear()
+
+        test_durations.append((self.id(), time.perf_counter() - self.started))
 
     """
     TODO
@@ -59,6 +363,72 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertTrue(len(data['categories']))
 
+    """
+    Test revalidation of categories with etag
+    """
+
+    def test_304_get_categories_with_matching_etag(self):
+        res = self.client().get('/categories')
+        etag = res.headers.get('ETag')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNotNone(etag)
+
+        # an unchanged category list is not sent again
+        res = self.client().get('/categories',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+
+    """
+    Test category cache invalidation on category writes
+    """
+
+    def test_get_categories_after_category_insert(self):
+        self.client().get('/categories')
+
+        category = Category(type='Music')
+        category.insert()
+
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        category.delete()
+
+        # check the new category is served instead of the cached list
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['categories'][str(category.id)], 'Music')
+
+    """
+    Test question counts per category, updated on question writes
+    """
+
+    def test_get_categories_with_counts(self):
+        res = self.client().get('/categories?counts=true')
+        data = json.loads(res.data)
+
+        # check every category is counted like the database does
+        self.assertEqual(res.status_code, 200)
+        for category_id in data['categories']:
+            count = Question.query.filter(
+                Question.category == int(category_id)).count()
+            self.assertEqual(data['question_counts'][category_id], count)
+        self.assertEqual(sum(data['difficulties']['3'].values()),
+                         data['question_counts']['3'])
+
+        # a new question is counted instead of serving the cached counts
+        Question('Which river flows through Cairo?', 'Nile', 3, 5).insert()
+        res = self.client().get('/categories?counts=true')
+        counts = json.loads(res.data)
+
+        self.assertEqual(counts['question_counts']['3'],
+                         data['question_counts']['3'] + 1)
+        self.assertEqual(counts['difficulties']['3']['5'],
+                         data['difficulties']['3'].get('5', 0) + 1)
+        self.assertNotEqual(res.headers.get('ETag'),
+                            self.client().get('/categories').headers.get(
+                                'ETag'))
+
     """
     Test non-existent category
     """
@@ -101,6 +471,42 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    """
+    Test cursor pagination of questions
+    """
+
+    def test_get_questions_with_cursor(self):
+        res = self.client().get('/questions?cursor=')
+        data = json.loads(res.data)
+
+        # check status and status message
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(data['next_cursor'])
+
+        # the next page starts right after the last question returned
+        res = self.client().get(
+            '/questions?cursor={}'.format(data['next_cursor']))
+        next_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(next_data['questions'][0]['id'],
+                           data['questions'][-1]['id'])
+
+    """
+    Test invalid cursor
+    """
+
+    def test_400_get_questions_with_invalid_cursor(self):
+        res = self.client().get('/questions?cursor=not-a-cursor')
+        data = json.loads(res.data)
+
+        # check status and status message
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     """
     Test deletion of question
     """
@@ -163,6 +569,33 @@ class TriviaTestCase(unittest.TestCase):
         # assert created question.id is not None
         self.assertIsNotNone(data['created'])
 
+    """
+    Test minimal and full responses of question writes
+    """
+
+    def test_write_response_modes(self):
+        total = Question.query.count()
+
+        # minimal by default: the id and the total number of questions
+        res = self.client().post('/questions', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers.get('Preference-Applied'),
+                         'return=minimal')
+        self.assertEqual(data['total_questions'], total + 1)
+        self.assertNotIn('questions', data)
+
+        # legacy clients ask for the first page of questions
+        res = self.client().delete(
+            '/questions/{}'.format(data['created']),
+            headers={'Prefer': 'return=representation'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], total)
+        self.assertEqual(len(data['questions']), 10)
+
     """
     Test question creation failure
     """
@@ -184,6 +617,87 @@ class TriviaTestCase(unittest.TestCase):
         # check if total questions before and after post request are equal
         self.assertTrue(len(questions_after) == len(questions_before))
 
+    """
+    Test bulk creation and deletion of questions
+    """
+
+    def test_create_and_delete_questions_bulk(self):
+        total = Question.query.count()
+        lines = [json.dumps(dict(self.new_question, question='Bulk {}?'.format(
+            number))) for number in range(3)]
+        res = self.client().post('/questions/bulk', data='\n'.join(lines),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        # check status and the questions were created with their ids
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_created'], 3)
+        self.assertEqual(Question.query.count(), total + 3)
+        self.assertEqual(
+            [Question.query.get(question_id).question
+             for question_id in data['created']],
+            ['Bulk 0?', 'Bulk 1?', 'Bulk 2?'])
+
+        # delete them again together with an id that does not exist
+        res = self.client().delete('/questions/bulk',
+                                   json=data['created'] + [1000])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_deleted'], 3)
+        self.assertEqual(data['not_found'], [1000])
+        self.assertEqual(Question.query.count(), total)
+
+    """
+    Test bulk creation fails as a whole on an invalid question
+    """
+
+    def test_422_create_questions_bulk_invalid_question(self):
+        total = Question.query.count()
+        res = self.client().post('/questions/bulk', json=[
+            self.new_question, dict(self.new_question, answer='')])
+        data = json.loads(res.data)
+
+        # check status and nothing was created
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(Question.query.count(), total)
+
+    """
+    Test creating a question that repeats an existing one
+    """
+
+    def test_409_create_duplicate_question(self):
+        total = Question.query.count()
+        existing = Question.query.filter(
+            Question.question == 'What is the largest lake in Africa?').one()
+        res = self.client().post('/questions', json=dict(
+            self.new_question, question='what is the  LARGEST lake in Africa'))
+        data = json.loads(res.data)
+
+        # check status, the existing question and nothing was created
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['duplicate_of'], existing.id)
+        self.assertEqual(Question.query.count(), total)
+
+    """
+    Test bulk creation fails as a whole on duplicate questions
+    """
+
+    def test_409_create_questions_bulk_duplicate_question(self):
+        total = Question.query.count()
+        res = self.client().post('/questions/bulk', json=[
+            self.new_question, dict(self.new_question, question='Bulk?'),
+            dict(self.new_question, question='bulk!')])
+        data = json.loads(res.data)
+
+        # check status and the duplicate within the request
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['duplicates'],
+                         [{'index': 2, 'duplicate_of_index': 1}])
+        self.assertEqual(Question.query.count(), total)
+
     """
     Test search question
     """
@@ -199,6 +713,51 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsNotNone(data['questions'])
         self.assertIsNotNone(data['total_questions'])
 
+    """
+    Test search total counts every match, not only the current page
+    """
+
+    def test_search_question_total_counts_all_matches(self):
+        res = self.client().post('/questions', json={'searchTerm': 'e'})
+        data = json.loads(res.data)
+
+        matches = Question.query.filter(
+            Question.question.ilike('%e%')).count()
+
+        # check status and status message
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+
+        self.assertEqual(data['total_questions'], matches)
+        self.assertEqual(len(data['questions']), min(matches, 10))
+
+    """
+    Test the search index returns the results of the SQL search
+    """
+
+    def test_search_index_matches_sql_search(self):
+        question = Question('Which search index test is this?', 'The one',
+                            1, 1)
+        question.insert()
+
+        def search(backend, search_term):
+            self.app.config['SEARCH_BACKEND'] = backend
+            try:
+                res = self.client().post('/questions?cursor=',
+                                         json={'searchTerm': search_term})
+            finally:
+                self.app.config['SEARCH_BACKEND'] = 'sql'
+            data = json.loads(res.data)
+            return (res.status_code, data.get('total_questions'),
+                    [question['id'] for question in data.get('questions', [])],
+                    data.get('next_cursor'))
+
+        for search_term in ('medicine', 'e', 'TITLE', 'search index',
+                            'is th', 'ch sea', '?', 'the%st', 'wh_ch',
+                            'invalidsearchterm'):
+            self.assertEqual(search('index', search_term),
+                             search('sql', search_term), search_term)
+
     """
     Test search question failure
     """
@@ -229,6 +788,35 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(data['current_category'])
 
+    """
+    Test cached category questions include new questions right away
+    """
+
+    def test_get_questions_by_category_after_insert(self):
+        res = self.client().get('categories/3/questions')
+        data = json.loads(res.data)
+        total_before = data['total_questions']
+
+        question = Question(question=self.new_question['question'],
+                            answer=self.new_question['answer'],
+                            difficulty=self.new_question['difficulty'],
+                            category=self.new_question['category'])
+        question.insert()
+
+        res = self.client().get('categories/3/questions')
+        data = json.loads(res.data)
+
+        # check status and that the cached page was not served
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], total_before + 1)
+
+        question.delete()
+
+        res = self.client().get('categories/3/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['total_questions'], total_before)
+
     """"
     Test get questions by categories failure
     """
@@ -260,6 +848,540 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    """
+    Test responses are encoded with MessagePack for clients accepting it
+    """
+
+    def test_get_questions_msgpack(self):
+        res = self.client().get('/questions')
+        expected = json.loads(res.data)
+        res = self.client().get('/questions', headers={
+            'Accept': 'application/msgpack'})
+        data = msgpack.unpackb(res.data, strict_map_key=False)
+
+        # check the same response dictionary is sent, with integer keys
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers.get('Content-Type'),
+                         'application/msgpack')
+        self.assertIn('Accept', res.headers.get('Vary'))
+        self.assertEqual(data['questions'], expected['questions'])
+        self.assertEqual(data['categories'][1], expected['categories']['1'])
+
+        # errors are encoded the same way, JSON stays the default
+        res = self.client().post('/quizzes', json={}, headers={
+            'Accept': 'application/json;q=0.5, application/x-msgpack'})
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(msgpack.unpackb(res.data)['success'], False)
+        res = self.client().get('/questions', headers={'Accept': '*/*'})
+        self.assertEqual(res.headers.get('Content-Type'), 'application/json')
+
+    """
+    Test quiz question selection skips previous questions
+    """
+
+    def test_quiz_question_not_in_previous_questions(self):
+        questions = Question.query.filter(
+            Question.category == 3).order_by(Question.id).all()
+        previous_questions = [question.id for question in questions[1:]]
+
+        quiz_round_data = {
+            'previous_questions': previous_questions,
+            'quiz_category': {
+                'id': 3,
+                'type': 'Geography',
+            },
+        }
+        res = self.client().post('/quizzes', json=quiz_round_data)
+        data = json.loads(res.data)
+
+        # check status and the only question left to play is returned
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['id'], questions[0].id)
+
+        # no question is returned once every question was played
+        quiz_round_data['previous_questions'].append(questions[0].id)
+        res = self.client().post('/quizzes', json=quiz_round_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(data['question'])
+
+    """
+    Test prefetching several quiz questions in one request
+    """
+
+    def test_quiz_prefetch_returns_distinct_unseen_questions(self):
+        questions = Question.query.filter(
+            Question.category == 4).order_by(Question.id).all()
+        previous_questions = [questions[0].id]
+
+        res = self.client().post('/quizzes', json={
+            'previous_questions': previous_questions,
+            'quiz_category': {'id': 4, 'type': 'History'},
+            'count': 10,
+        })
+        data = json.loads(res.data)
+
+        # check status and every other question of the category is returned
+        # once, the first one also as "question"
+        self.assertEqual(res.status_code, 200)
+        question_ids = [question['id'] for question in data['questions']]
+        self.assertEqual(sorted(question_ids),
+                         [question.id for question in questions[1:]])
+        self.assertEqual(data['question'], data['questions'][0])
+        self.assertTrue(all(question['category'] == 4
+                            for question in data['questions']))
+
+        # too many questions at once are rejected
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 4, 'type': 'History'},
+            'count': 11,
+        })
+        self.assertEqual(res.status_code, 422)
+
+    """
+    Test adaptive quiz difficulty follows the recent answers
+    """
+
+    def test_adaptive_quiz_follows_correctness(self):
+        def next_question(previous_questions, results):
+            res = self.client().post('/quizzes', json={
+                'previous_questions': previous_questions,
+                'quiz_category': {'id': 0, 'type': 'click'},
+                'mode': 'adaptive',
+                'results': results,
+            })
+            self.assertEqual(res.status_code, 200)
+            return json.loads(res.data)['question']
+
+        # the first question has the start difficulty
+        first = next_question([], [])
+        self.assertEqual(first['difficulty'], 2)
+
+        # a correct answer raises the difficulty, a wrong one lowers it
+        harder = next_question([first['id']], [True])
+        self.assertEqual(harder['difficulty'], 3)
+        easier = next_question([first['id']], [False])
+        self.assertEqual(easier['difficulty'], 1)
+
+        # unknown modes are rejected
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 0, 'type': 'click'},
+            'mode': 'hardest',
+        })
+        self.assertEqual(res.status_code, 422)
+
+    """
+    Test quiz session play
+    """
+
+    def test_quiz_session_serves_each_question_once(self):
+        res = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {'id': 3, 'type': 'Geography'}})
+        data = json.loads(res.data)
+
+        # check status and status message
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        session_id = data['session_id']
+        total_questions = data['total_questions']
+
+        # play until the session runs out of questions
+        played = []
+        for _ in range(total_questions + 1):
+            res = self.client().post(
+                f'/quizzes/sessions/{session_id}/questions')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            if data['question'] is None:
+                break
+            played.append(data['question']['id'])
+
+        self.assertEqual(len(played), total_questions)
+        self.assertEqual(len(set(played)), total_questions)
+
+        res = self.client().delete(f'/quizzes/sessions/{session_id}')
+        self.assertEqual(res.status_code, 200)
+
+    """
+    Test quiz session deck
+    """
+
+    def test_quiz_deck_draws_each_position_once(self):
+        deck = QuizDeck()
+        drawn = [deck.draw(1000) for _ in range(10)]
+
+        # a few draws store a few swaps, whatever the size of the pool
+        self.assertEqual(len(set(drawn)), 10)
+        self.assertLessEqual(len(deck.swaps), 10)
+
+        drawn += iter(lambda: deck.draw(1000), None)
+        self.assertEqual(sorted(drawn), list(range(1000)))
+        self.assertEqual(deck.swaps, {})
+
+    """
+    Test non-existent quiz session
+    """
+
+    def test_404_quiz_session_not_found(self):
+        res = self.client().post('/quizzes/sessions/unknown/questions')
+        data = json.loads(res.data)
+
+        # check status and status message
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    """
+    Test quiz questions without their answer
+    """
+
+    def test_quiz_questions_without_answer(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [], 'count': 2,
+            'quiz_category': {'id': 3, 'type': 'Geography'}})
+        data = json.loads(res.data)
+
+        # check status and that no question carries its answer by default
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['questions'])
+        for question in data['questions']:
+            self.assertNotIn('answer', question)
+            self.assertIn('question', question)
+        self.assertNotIn('answer', data['question'])
+
+        # a client checking answers itself asks for them
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [], 'include_answer': True,
+            'quiz_category': {'id': 3, 'type': 'Geography'}})
+        self.assertIn('answer', json.loads(res.data)['question'])
+
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [], 'include_answer': 'no',
+            'quiz_category': {'id': 3, 'type': 'Geography'}})
+        self.assertEqual(res.status_code, 422)
+
+        # the config sets the default of quiz sessions too
+        res = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {'id': 3, 'type': 'Geography'}})
+        session_id = json.loads(res.data)['session_id']
+        try:
+            res = self.client().post(
+                f'/quizzes/sessions/{session_id}/questions')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn('answer', data['question'])
+
+            self.app.config['QUIZ_INCLUDE_ANSWERS'] = True
+            res = self.client().post(
+                f'/quizzes/sessions/{session_id}/questions')
+            data = json.loads(res.data)
+            self.assertIn('answer', data['question'])
+        finally:
+            self.app.config['QUIZ_INCLUDE_ANSWERS'] = False
+            self.client().delete(f'/quizzes/sessions/{session_id}')
+
+    """
+    Test answers are checked on the server
+    """
+
+    def test_check_quiz_answer(self):
+        question = Question('Who painted the Mona Lisa?',
+                            'Leonardo da Vinci', 2, 3)
+        question.insert()
+
+        def check(answer):
+            res = self.client().post('/quizzes/answer', json={
+                'question_id': question.id, 'answer': answer})
+            self.assertEqual(res.status_code, 200)
+            return json.loads(res.data)
+
+        # case, punctuation and a small typo are forgiven
+        data = check('leonardo da vinchi!')
+        self.assertEqual(data['correct'], True)
+        self.assertEqual(data['answer'], 'Leonardo da Vinci')
+
+        # a wrong answer does not reveal the expected one
+        data = check('Michelangelo')
+        self.assertEqual(data['correct'], False)
+        self.assertNotIn('answer', data)
+        self.assertNotIn('answer', check(''))
+
+        # booleans are not question ids
+        res = self.client().post('/quizzes/answer', json={
+            'question_id': True, 'answer': 'Leonardo da Vinci'})
+        self.assertEqual(res.status_code, 422)
+
+        # an updated answer is checked against the new answer
+        question.answer = 'Michelangelo'
+        question.update()
+        self.assertEqual(check('Michelangelo')['correct'], True)
+
+    """
+    Test checking the answer to a question that does not exist
+    """
+
+    def test_404_check_quiz_answer_question_not_found(self):
+        res = self.client().post('/quizzes/answer', json={
+            'question_id': 100000, 'answer': 'Pacific'})
+        data = json.loads(res.data)
+
+        # check status and status message
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    """
+    Test recorded quiz scores appear on the leaderboard once flushed
+    """
+
+    def test_record_quiz_results_and_leaderboard(self):
+        res = self.client().post('/quizzes/attempts', json={
+            'question_id': 5, 'correct': True, 'player': 'ada',
+            'quiz_category': {'id': 4, 'type': 'History'}})
+        self.assertEqual(res.status_code, 202)
+
+        for player, score in (('ada', 3), ('grace', 5)):
+            res = self.client().post('/quizzes/scores', json={
+                'player': player, 'score': score, 'total': 5,
+                'quiz_category': {'id': 4, 'type': 'History'}})
+            self.assertEqual(res.status_code, 202)
+
+        # the results are buffered until the buffer is flushed
+        self.assertEqual(self.app.extensions['result_buffer'].flush(), 3)
+        self.assertEqual(QuizAttempt.query.count(), 1)
+
+        res = self.client().get('/leaderboard?category=4')
+        data = json.loads(res.data)
+
+        # check status and the best score comes first
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual([(score['player'], score['score'])
+                          for score in data['scores']],
+                         [('grace', 5), ('ada', 3)])
+
+    """
+    Test recording an invalid quiz score
+    """
+
+    def test_422_record_invalid_quiz_score(self):
+        res = self.client().post('/quizzes/scores', json={
+            'player': 'ada', 'score': 7, 'total': 5})
+        data = json.loads(res.data)
+
+        # check status and status message
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+        # values out of the range of the integer columns and booleans
+        for body in ({'player': 'x', 'score': 0, 'total': 2 ** 64},
+                     {'player': 'x', 'score': True, 'total': 2},
+                     {'player': 'x', 'score': 1, 'total': 2,
+                      'quiz_category': {'id': 2 ** 40}}):
+            res = self.client().post('/quizzes/scores', json=body)
+            self.assertEqual(res.status_code, 422)
+        res = self.client().post('/quizzes/attempts', json={
+            'question_id': True, 'correct': True})
+        self.assertEqual(res.status_code, 422)
+
+    """
+    Test a row rejected by the database does not hold back the others
+    """
+
+    def test_result_buffer_drops_rejected_rows(self):
+        buffer = self.app.extensions['result_buffer']
+        for score in (1, 2):
+            buffer.append(QuizScore.__table__, {
+                'player': 'ada', 'category': None, 'score': score,
+                'total': 5, 'created_at': datetime.utcnow()})
+        buffer.append(QuizScore.__table__, {
+            'player': None, 'category': None, 'score': 1, 'total': 5,
+            'created_at': datetime.utcnow()})
+
+        # the batch is rejected, its valid rows are written one by one
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.size, 0)
+        self.assertEqual(QuizScore.query.filter_by(player='ada').count(), 2)
+
+    """
+    Test load shedding when a route is saturated
+    """
+
+    def test_503_request_rejected_by_admission_control(self):
+        admission = self.app.extensions['admission']
+        limiter = admission.limiter('get_categories')
+        limit, queue_size = limiter.limit, limiter.queue_size
+
+        # no free slot and no room in the queue
+        limiter.limit, limiter.queue_size = 0, 0
+        try:
+            res = self.client().get('/categories')
+        finally:
+            limiter.limit, limiter.queue_size = limit, queue_size
+        data = json.loads(res.data)
+
+        # check status and status message
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'service unavailable')
+        self.assertEqual(res.headers.get('Retry-After'), '1')
+
+        # the rejection is reported
+        res = self.client().get('/admission')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(
+            data['routes']['get_categories']['rejected'], 1)
+
+    """
+    Test the metrics endpoint
+    """
+
+    def test_get_metrics(self):
+        self.client().get('/categories')
+        res = self.client().get('/metrics')
+        body = res.data.decode('utf-8')
+
+        # check status and content type
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(
+            res.headers.get('Content-Type').startswith('text/plain'))
+
+        # check the request counter, histogram and database time
+        self.assertIn('trivia_http_requests_total{endpoint="get_categories",'
+                      'method="GET",status="200"}', body)
+        self.assertIn('trivia_http_request_duration_seconds_bucket{'
+                      'endpoint="get_categories",le="+Inf"}', body)
+        self.assertIn('trivia_db_queries_total{endpoint="get_categories"}',
+                      body)
+
+    """
+    Test the quiz route is limited and measured, also in ASGI mode
+    """
+
+    def test_quiz_admission_control_and_metrics(self):
+        limiter = self.app.extensions['admission'].limiter(
+            'generate_random_quiz_question')
+        limit, queue_size = limiter.limit, limiter.queue_size
+        quiz_round_data = {'previous_questions': [],
+                           'quiz_category': {'id': 0, 'type': 'click'}}
+
+        # no free slot and no room in the queue
+        limiter.limit, limiter.queue_size = 0, 0
+        try:
+            res = self.client().post('/quizzes', json=quiz_round_data)
+        finally:
+            limiter.limit, limiter.queue_size = limit, queue_size
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers.get('Retry-After'), '1')
+
+        res = self.client().post('/quizzes', json=quiz_round_data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(limiter.stats()['active'], 0)
+
+        # both requests are counted
+        body = self.client().get('/metrics').data.decode('utf-8')
+        for status in ('200', '503'):
+            self.assertIn('trivia_http_requests_total{'
+                          'endpoint="generate_random_quiz_question",'
+                          'method="POST",status="' + status + '"}', body)
+        self.assertIn('trivia_db_queries_total{'
+                      'endpoint="generate_random_quiz_question"}', body)
+
+    """
+    Test a quiz round survives the question pool being dropped
+    """
+
+    def test_quiz_question_pool_dropped_during_round(self):
+        loader = question_pool.loader
+        choose = question_pool.choose
+        dropped = []
+
+        def checked_loader():
+            # the async route of the ASGI mode must never block its loop
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return loader()
+            raise AssertionError('question pool loaded on the event loop')
+
+        def dropping_choose(*args, **kwargs):
+            # a write of another thread drops the pool while picking
+            if not dropped:
+                dropped.append(True)
+                question_pool.invalidate()
+            return choose(*args, **kwargs)
+
+        question_pool.loader = checked_loader
+        question_pool.choose = dropping_choose
+        try:
+            res = self.client().post('/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': {'id': 3, 'type': 'Geography'}})
+        finally:
+            question_pool.loader = loader
+            del question_pool.choose
+        data = json.loads(res.data)
+
+        # check status and a question was picked from the reloaded pool
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['category'], 3)
+        self.assertEqual(dropped, [True])
+
+    """
+    Test the ASGI mode serves Flask routes concurrently
+    """
+
+    def test_asgi_passthrough_routes_run_concurrently(self):
+        from flaskr.asgi import ThreadPoolWsgiToAsgi
+
+        threads = set()
+
+        def slow_view(environ, start_response):
+            threads.add(threading.get_ident())
+            time.sleep(0.2)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'ok']
+
+        adapter = ThreadPoolWsgiToAsgi(slow_view)
+
+        async def request():
+            sent = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'',
+                        'more_body': False}
+
+            async def send(message):
+                sent.append(message)
+
+            await adapter({
+                'type': 'http', 'http_version': '1.1', 'method': 'GET',
+                'path': '/questions', 'query_string': b'', 'headers': [],
+                'server': ('localhost', 80)}, receive, send)
+            return sent[0]['status']
+
+        async def requests():
+            return await asyncio.gather(*[request() for _ in range(5)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            start = time.perf_counter()
+            statuses = loop.run_until_complete(requests())
+            elapsed = time.perf_counter() - start
+        finally:
+            loop.close()
+
+        # five 0.2 s requests on five threads instead of one after another
+        self.assertEqual(statuses, [200] * 5)
+        self.assertEqual(len(threads), 5)
+        self.assertLess(elapsed, 0.6)
+
     """
      Test random question selection failure for quiz
     """
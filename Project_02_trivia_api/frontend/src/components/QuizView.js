@@ -16,6 +16,8 @@ class QuizView extends Component {
         numCorrect: 0,
         currentQuestion: {},
         guess: '',
+        correct: false,
+        answer: null,
         forceEnd: false
     }
   }
@@ -79,11 +81,33 @@ class QuizView extends Component {
 
   submitGuess = (event) => {
     event.preventDefault();
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
-    this.setState({
-      numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
-      showAnswer: true,
+    // the answer is checked by the server, questions come without it
+    $.ajax({
+      url: '/quizzes/answer',
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        question_id: this.state.currentQuestion.id,
+        answer: this.state.guess
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({
+          numCorrect: !result.correct ? this.state.numCorrect : this.state.numCorrect + 1,
+          correct: result.correct,
+          answer: result.answer || null,
+          showAnswer: true,
+        })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to check the answer. Please try your request again')
+        return;
+      }
     })
   }
 
@@ -95,6 +119,8 @@ class QuizView extends Component {
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
+      correct: false,
+      answer: null,
       forceEnd: false
     })
   }
@@ -130,20 +156,13 @@ class QuizView extends Component {
     )
   }
 
-  evaluateAnswer = () => {
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    const answerArray = this.state.currentQuestion.answer.toLowerCase().split(' ');
-    return answerArray.includes(formatGuess)
-  }
-
   renderCorrectAnswer(){
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
+    let evaluate = this.state.correct
     return(
       <div className="quiz-play-holder">
         <div className="quiz-question">{this.state.currentQuestion.question}</div>
         <div className={`${evaluate ? 'correct' : 'wrong'}`}>{evaluate ? "You were correct!" : "You were incorrect"}</div>
-        <div className="quiz-answer">{this.state.currentQuestion.answer}</div>
+        {this.state.answer && <div className="quiz-answer">{this.state.answer}</div>}
         <div className="next-question button" onClick={this.getNextQuestion}> Next Question </div>
       </div>
     )
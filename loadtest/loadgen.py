@@ -0,0 +1,433 @@
+'''
+loadgen.py
+    scenario based load generator for the fyyur, trivia and todoapp
+    flask applications
+
+Each application defines a list of weighted scenarios. A scenario is a
+function that receives a Client and issues one or more requests against
+the real routes of the application. Workers pick scenarios at random
+according to their weight and run them until the duration (or request
+budget) is exhausted. At the end a report with throughput, error rate and
+latency histograms is printed for every scenario and for the whole run.
+
+Usage:
+    python loadgen.py trivia --url http://127.0.0.1:5000 --workers 8 --duration 30
+    python loadgen.py fyyur --start --workers 4 --requests 2000
+'''
+
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# upper bounds (in milliseconds) of the latency histogram buckets
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+# ----------------------------------------------------------------------------#
+# Statistics.
+# ----------------------------------------------------------------------------#
+
+class Stats:
+    '''
+    Stats
+        request counters and latency histogram for one scenario
+    '''
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latencies = []
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def record(self, latency_ms, error):
+        self.requests += 1
+        if error:
+            self.errors += 1
+        self.latencies.append(latency_ms)
+        for index, bound in enumerate(HISTOGRAM_BUCKETS):
+            if latency_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.errors += other.errors
+        self.latencies.extend(other.latencies)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1,
+                    int(math.ceil(percent / 100.0 * len(ordered))) - 1)
+        return ordered[max(index, 0)]
+
+
+# ----------------------------------------------------------------------------#
+# HTTP client.
+# ----------------------------------------------------------------------------#
+
+class Client:
+    '''
+    Client
+        small urllib based http client that records every request
+        against the stats of the scenario currently being run
+    '''
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.stats = None
+
+    def request(self, method, path, json_body=None, form=None):
+        data = None
+        headers = {}
+        if json_body is not None:
+            data = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form, doseq=True).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        req = urllib.request.Request(self.base_url + path, data=data,
+                                     headers=headers, method=method)
+        start = time.perf_counter()
+        status = None
+        body = b''
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as res:
+                status = res.status
+                body = res.read()
+        except urllib.error.HTTPError as error:
+            status = error.code
+            body = error.read()
+        except (urllib.error.URLError, socket.timeout, ConnectionError):
+            status = None
+        latency_ms = (time.perf_counter() - start) * 1000.0
+
+        # count connection failures and 5xx responses as errors
+        error = status is None or status >= 500
+        self.stats.record(latency_ms, error)
+        return status, body
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def post(self, path, json_body=None, form=None):
+        return self.request('POST', path, json_body=json_body, form=form)
+
+    def get_json(self, path):
+        status, body = self.get(path)
+        return status, _load_json(body)
+
+    def post_json(self, path, json_body):
+        status, body = self.post(path, json_body=json_body)
+        return status, _load_json(body)
+
+
+def _load_json(body):
+    try:
+        return json.loads(body.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+# ----------------------------------------------------------------------------#
+# Fyyur scenarios.
+# ----------------------------------------------------------------------------#
+
+FYYUR_SEARCH_TERMS = ['Music', 'Hop', 'Park', 'Guns', 'band', 'a']
+
+
+def fyyur_browse(client, options):
+    client.get('/')
+    client.get(random.choice(['/venues', '/artists', '/shows']))
+
+
+def fyyur_search(client, options):
+    term = random.choice(FYYUR_SEARCH_TERMS)
+    if random.random() < 0.5:
+        client.post('/venues/search', form={'search_term': term})
+    else:
+        client.post('/artists/search', form={'search_term': term})
+
+
+def fyyur_detail(client, options):
+    entity_id = random.randint(1, options.max_id)
+    if random.random() < 0.5:
+        client.get('/venues/{}'.format(entity_id))
+    else:
+        client.get('/artists/{}'.format(entity_id))
+
+
+def fyyur_create(client, options):
+    suffix = random.randint(0, 10 ** 9)
+    client.post('/artists/create', form={
+        'name': 'Load Test Artist {}'.format(suffix),
+        'city': 'San Francisco',
+        'state': 'CA',
+        'phone': '123-123-1234',
+        'genres': ['Jazz'],
+        'facebook_link': 'https://www.facebook.com/loadtest',
+        'image_link': '',
+        'website': '',
+        'seeking_description': '',
+    })
+
+
+# ----------------------------------------------------------------------------#
+# Trivia scenarios.
+# ----------------------------------------------------------------------------#
+
+TRIVIA_SEARCH_TERMS = ['who', 'what', 'title', 'medicine', 'soccer']
+
+
+def trivia_questions_paging(client, options):
+    # walk the first pages the way the list view does
+    for page in range(1, random.randint(1, 3) + 1):
+        status, data = client.get_json('/questions?page={}'.format(page))
+        if status != 200:
+            break
+
+
+def trivia_category_listing(client, options):
+    client.get_json('/categories/{}/questions'.format(
+        random.randint(1, options.max_id)))
+
+
+def trivia_search(client, options):
+    client.post_json('/questions',
+                     {'searchTerm': random.choice(TRIVIA_SEARCH_TERMS)})
+
+
+def trivia_quiz_session(client, options):
+    # play one quiz the way the frontend does: fetch the categories, then
+    # request questions until the pool is exhausted or the round limit
+    status, data = client.get_json('/categories')
+    category_ids = [0]
+    if status == 200 and data:
+        category_ids += [int(key) for key in data.get('categories', {})]
+    quiz_category = {'id': random.choice(category_ids), 'type': 'load test'}
+
+    previous_questions = []
+    for _ in range(options.quiz_rounds):
+        status, data = client.post_json('/quizzes', {
+            'previous_questions': previous_questions,
+            'quiz_category': quiz_category,
+        })
+        if status != 200 or not data or not data.get('question'):
+            break
+        previous_questions.append(data['question']['id'])
+
+
+# ----------------------------------------------------------------------------#
+# Todoapp scenarios.
+# ----------------------------------------------------------------------------#
+
+def todoapp_list_view(client, options):
+    client.get('/lists/{}'.format(random.randint(1, options.max_id)))
+
+
+def todoapp_toggle_todo(client, options):
+    client.post('/todos/{}/set-completed'.format(
+        random.randint(1, options.max_id)),
+        json_body={'completed': random.random() < 0.5})
+
+
+def todoapp_toggle_list(client, options):
+    client.post('/lists/{}/set-completed'.format(
+        random.randint(1, options.max_id)),
+        json_body={'completed': False})
+
+
+# ----------------------------------------------------------------------------#
+# Applications.
+# ----------------------------------------------------------------------------#
+
+# name: (working directory, FLASK_APP, [(weight, scenario), ...])
+APPLICATIONS = {
+    'fyyur': ('Project_01_fyyur', 'app', [
+        (50, fyyur_browse),
+        (20, fyyur_search),
+        (25, fyyur_detail),
+        (5, fyyur_create),
+    ]),
+    'trivia': (os.path.join('Project_02_trivia_api', 'backend'), 'flaskr', [
+        (35, trivia_questions_paging),
+        (20, trivia_category_listing),
+        (10, trivia_search),
+        (35, trivia_quiz_session),
+    ]),
+    'todoapp': ('todoapp', 'app', [
+        (70, todoapp_list_view),
+        (25, todoapp_toggle_todo),
+        (5, todoapp_toggle_list),
+    ]),
+}
+
+
+def start_server(app_name, port):
+    '''
+    start_server(app_name, port)
+        starts the flask development server of the application and
+        waits until it accepts connections
+    '''
+    directory, flask_app, _ = APPLICATIONS[app_name]
+    env = dict(os.environ, FLASK_APP=flask_app, FLASK_ENV='production')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'flask', 'run', '--port', str(port),
+         '--with-threads'],
+        cwd=os.path.join(ROOT_DIR, directory), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('{} server exited with code {}'.format(
+                app_name, process.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError('{} server did not start on port {}'.format(
+        app_name, port))
+
+
+def run_worker(options, scenarios, results, stop_at, budget, lock):
+    client = Client(options.url, options.timeout)
+    weights = [weight for weight, _ in scenarios]
+    local_stats = {scenario.__name__: Stats() for _, scenario in scenarios}
+
+    while time.time() < stop_at:
+        with lock:
+            if budget[0] is not None:
+                if budget[0] <= 0:
+                    break
+                budget[0] -= 1
+        scenario = random.choices(scenarios, weights=weights)[0][1]
+        client.stats = local_stats[scenario.__name__]
+        scenario(client, options)
+
+    with lock:
+        for name, stats in local_stats.items():
+            results[name].merge(stats)
+
+
+def run(options):
+    _, _, scenarios = APPLICATIONS[options.app]
+    results = {scenario.__name__: Stats() for _, scenario in scenarios}
+    lock = threading.Lock()
+    # budget counts scenario runs when --requests is used
+    budget = [options.requests]
+
+    start = time.time()
+    stop_at = start + options.duration if options.duration else float('inf')
+    workers = [threading.Thread(target=run_worker,
+                                args=(options, scenarios, results,
+                                      stop_at, budget, lock))
+               for _ in range(options.workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return results, time.time() - start
+
+
+def format_histogram(stats):
+    lines = []
+    labels = ['<= {} ms'.format(bound) for bound in HISTOGRAM_BUCKETS]
+    labels.append('>  {} ms'.format(HISTOGRAM_BUCKETS[-1]))
+    widest = max(stats.buckets) or 1
+    for label, count in zip(labels, stats.buckets):
+        if count:
+            bar = '#' * max(1, int(40 * count / widest))
+            lines.append('    {:>10} {:>8} {}'.format(label, count, bar))
+    return '\n'.join(lines)
+
+
+def report(results, elapsed):
+    total = Stats()
+    for stats in results.values():
+        total.merge(stats)
+
+    print('elapsed: {:.2f} s'.format(elapsed))
+    for name, stats in list(results.items()) + [('TOTAL', total)]:
+        if not stats.requests:
+            continue
+        print('')
+        print('{}'.format(name))
+        print('  requests: {}  throughput: {:.1f} req/s  error rate: {:.2%}'
+              .format(stats.requests, stats.requests / elapsed,
+                      stats.errors / stats.requests))
+        print('  latency ms  p50: {:.1f}  p90: {:.1f}  p99: {:.1f}  max: {:.1f}'
+              .format(stats.percentile(50), stats.percentile(90),
+                      stats.percentile(99), max(stats.latencies)))
+        print(format_histogram(stats))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Weighted scenario load generator for the flask apps')
+    parser.add_argument('app', choices=sorted(APPLICATIONS))
+    parser.add_argument('--url', default=None,
+                        help='base url of a running server '
+                             '(default http://127.0.0.1:<port>)')
+    parser.add_argument('--start', action='store_true',
+                        help='start the application server locally')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to run (0 to rely on --requests)')
+    parser.add_argument('--requests', type=int, default=None,
+                        help='number of scenario runs before stopping')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--max-id', type=int, default=6,
+                        help='highest entity id used by detail scenarios')
+    parser.add_argument('--quiz-rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=None)
+    options = parser.parse_args(argv)
+
+    if not options.duration and options.requests is None:
+        parser.error('either --duration or --requests must be set')
+    if options.url is None:
+        options.url = 'http://127.0.0.1:{}'.format(options.port)
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.seed is not None:
+        random.seed(options.seed)
+
+    server = start_server(options.app, options.port) if options.start else None
+    try:
+        results, elapsed = run(options)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report(results, elapsed)
+
+
+if __name__ == '__main__':
+    main()